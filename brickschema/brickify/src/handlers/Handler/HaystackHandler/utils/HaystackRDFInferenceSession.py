@@ -24,8 +24,7 @@ class HaystackRDFInferenceSession(HaystackInferenceSession):
                     marker.split("#")[-1] for marker in str(markers).split(" ")
                 ]
                 marker_tags = list(set(marker_tags))
-                for f in self._filters:
-                    marker_tags = list(filter(f, marker_tags))
+                marker_tags = [t for t in marker_tags if self._accept_tag(t)]
                 # translate tags
                 entity_tagset = list(self._translate_tags(marker_tags))
                 # infer tags for single entity
@@ -3,29 +3,50 @@ The `graph` module provides a wrapper class + convenience methods for
 building and querying a Brick graph
 """
 import io
+import re
+import functools
+import hashlib
+import importlib.util
 from warnings import warn
 import os
 import sys
 import glob
 import pkgutil
+import secrets
 import rdflib
-import owlrl
-import pyshacl
+from rdflib.plugins.stores.memory import Memory
 import logging
 from typing import List
-from .inference import (
-    OWLRLNaiveInferenceSession,
-    OWLRLReasonableInferenceSession,
-    OWLRLAllegroInferenceSession,
-    TagInferenceSession,
-    HaystackInferenceSession,
-    VBISTagInferenceSession,
-)
 from . import namespaces as ns
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# probe once for the optional reasonable reasoner rather than on every expand()
+_HAS_REASONABLE = importlib.util.find_spec("reasonable") is not None
+
+# profiles whose expansion is complete after one call, so repeating it on an
+# unchanged graph adds nothing; see BrickBase._expand_signature
+_FIXPOINT_PROFILES = ("rdfs", "owlrl", "vbis")
+
+# one N-Triples statement (or blank/comment line) as rdflib's N-Triples parser reads
+# it; used to detect Turtle files that are written in the canonical N-Triples subset.
+# IRIs must be absolute (have a scheme): relative ones are valid Turtle, resolved
+# against the file's base, but the N-Triples parser rejects them. Terms must be
+# separated by spaces or tabs, and only the escapes valid in Turtle are accepted
+_NT_IRI = r"<[A-Za-z][A-Za-z0-9+.-]*:[^<>\"{}|^`\\\s]*>"
+_NT_BNODE = r"_:[A-Za-z0-9_](?:[-A-Za-z0-9_.]*[-A-Za-z0-9_])?"
+_NT_LITERAL = (
+    r'"(?:[^"\\\n\r]|\\[tbnrf"\'\\]|\\u[0-9A-Fa-f]{4}|\\U[0-9A-Fa-f]{8})*"'
+    r"(?:@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*|\^\^" + _NT_IRI + ")?"
+)
+_NT_LINE = re.compile(
+    rf"[ \t]*(?:(?:{_NT_IRI}|{_NT_BNODE})[ \t]+{_NT_IRI}[ \t]+"
+    rf"(?:{_NT_IRI}|{_NT_BNODE}|{_NT_LITERAL})[ \t]*\.[ \t]*)?(?:#.*)?"
+)
+# how much of a Turtle file _is_ntriples_file looks at
+_NT_PROBE_SIZE = 4096
+
 
 class BrickBase(rdflib.Graph):
     def rebuild_tag_lookup(self, brick_file=None):
@@ -33,10 +54,45 @@ class BrickBase(rdflib.Graph):
         Rebuilds the internal tag lookup dictionary used for Brick tag->class inference.
         This is broken out as its own method because it is potentially an expensive operation.
         """
+        from .inference import TagInferenceSession
+
         self._tagbackend = TagInferenceSession(
             rebuild_tag_lookup=True, brick_file=brick_file, approximate=False
         )
 
+    def query(
+        self,
+        query_object,
+        processor="sparql",
+        result="sparql",
+        initNs=None,
+        initBindings=None,
+        use_store_provided=True,
+        **kwargs,
+    ):
+        """
+        Queries the graph. Acts the same as rdflib.Graph.query, except that SPARQL
+        query strings against an in-memory store are parsed once and then reused
+        (keyed on the query text and the graph's prefix bindings)
+        """
+        if (
+            isinstance(query_object, str)
+            and processor == "sparql"
+            and initNs is None
+            and not kwargs
+            and isinstance(self.store, Memory)
+        ):
+            query_object = _prepare_query(query_object, tuple(self.namespaces()))
+        return super().query(
+            query_object,
+            processor,
+            result,
+            initNs,
+            initBindings,
+            use_store_provided,
+            **kwargs,
+        )
+
     def to_networkx(self):
         """
         Exports the graph as a NetworkX DiGraph. Edge labels are stored in the 'name' attribute
@@ -69,6 +125,9 @@ class BrickBase(rdflib.Graph):
 
         # given a list of classes and an ontology (self), return the classes
         # which are not the transtivie parent of any other class in the list.
+        brick = self.store.namespace("brick") or ns.BRICK
+        equivalence = [ns.OWL.equivalentClass, rdflib.URIRef(brick + "aliasOf")]
+        hierarchy = [ns.RDFS.subClassOf, ns.OWL.equivalentClass]
         specific = []
         for c in classlist:
             # Find the transtive parent by computing transitive closure of rdfs:subClassOf|owl:equivalentClass|brick:aliasOf
@@ -76,19 +135,11 @@ class BrickBase(rdflib.Graph):
             # If the intersection is empty, then the class is not a parent of any other class in the list
             # and is therefore specific
             # if the intersection is only the class itself or anything it is equivalent to, then it is specific
-            closure_query = f"""
-            SELECT ?parent WHERE {{
-                ?parent (rdfs:subClassOf|owl:equivalentClass)+ <{c}> .
-            }}
-            """
-            closure = set(x[0] for x in self.query(closure_query))
-
-            equivalent_query = f"""
-            SELECT ?parent WHERE {{
-                <{c}> (owl:equivalentClass|brick:aliasOf)+ ?parent .
-            }}
-            """
-            equivalent = set(x[0] for x in self.query(equivalent_query))
+            # equivalent to ?parent (rdfs:subClassOf|owl:equivalentClass)+ <c>
+            closure = self._transitive_subjects(c, hierarchy)
+
+            # equivalent to <c> (owl:equivalentClass|brick:aliasOf)+ ?parent
+            equivalent = self._transitive_objects(c, equivalence)
 
             if len(closure.intersection(classlist)) == 0 or closure.intersection(
                 classlist
@@ -97,6 +148,53 @@ class BrickBase(rdflib.Graph):
 
         return specific
 
+    def _transitive_objects(self, node, predicates):
+        """
+        Returns the nodes reachable from the given node by following one or more
+        of the given predicates; the equivalent of the SPARQL path (p1|p2|...)+
+
+        Args:
+            node (rdflib.Node): node to start from
+            predicates (list of rdflib.URIRef): predicates to follow
+
+        Returns:
+            reachable (set of rdflib.Node): the reachable nodes
+        """
+        reachable = set()
+        frontier = [node]
+        while frontier:
+            current = frontier.pop()
+            for pred in predicates:
+                for obj in self.objects(current, pred):
+                    if obj not in reachable:
+                        reachable.add(obj)
+                        frontier.append(obj)
+        return reachable
+
+    def _transitive_subjects(self, node, predicates):
+        """
+        Returns the nodes from which the given node is reachable by following one or
+        more of the given predicates; the equivalent of the SPARQL path
+        ?x (p1|p2|...)+ node
+
+        Args:
+            node (rdflib.Node): node to end at
+            predicates (list of rdflib.URIRef): predicates to follow
+
+        Returns:
+            reachable (set of rdflib.Node): the nodes that reach the given node
+        """
+        reachable = set()
+        frontier = [node]
+        while frontier:
+            current = frontier.pop()
+            for pred in predicates:
+                for subj in self.subjects(pred, current):
+                    if subj not in reachable:
+                        reachable.add(subj)
+                        frontier.append(subj)
+        return reachable
+
     def validate(
         self, shape_graphs=None, default_brick_shapes=True, engine: str = "pyshacl"
     ):
@@ -118,6 +216,8 @@ class BrickBase(rdflib.Graph):
             for sg in shape_graphs:
                 shapes += sg
         if engine == "pyshacl":
+            import pyshacl
+
             return pyshacl.validate(
                 self,
                 shacl_graph=shapes,
@@ -174,7 +274,7 @@ class BrickBase(rdflib.Graph):
         )
         extensions = glob.glob(os.path.join(extension_path, "*.ttl"))
         return [
-            os.path.basename(x).strip(".ttl")[len("brick_extension_") :]
+            os.path.basename(x).removesuffix(".ttl").removeprefix("brick_extension_")
             for x in extensions
         ]
 
@@ -191,11 +291,13 @@ class BrickBase(rdflib.Graph):
         )
         alignments = glob.glob(os.path.join(alignment_path, "*.ttl"))
         return [
-            os.path.basename(x)[len("Brick-") : -len("-alignment.ttl")]
+            os.path.basename(x).removeprefix("Brick-").removesuffix("-alignment.ttl")
             for x in alignments
         ]
 
     def _iterative_expand(self, og: "Graph"):
+        import pyshacl
+
         old_size = len(self)
         for _ in range(3):
             valid, _, report = pyshacl.validate(
@@ -212,6 +314,21 @@ class BrickBase(rdflib.Graph):
             if len(self) == old_size:
                 break
 
+    def _expand_signature(self, profile, backend, simplify, ontology_graph, iterative):
+        """
+        Returns a hashable signature of the arguments to expand() and the current
+        state of the graph, or None if the graph does not track its modifications
+        or the expansion may not be complete after one call
+        """
+        generation = getattr(self, "_generation", None)
+        if generation is None or ontology_graph is not None:
+            return None
+        # only profiles that run to a fixpoint add nothing when repeated; a SHACL
+        # pass (or a capped number of them) may leave rules to fire next time
+        if not all(prf in _FIXPOINT_PROFILES for prf in profile.split("+")):
+            return None
+        return (profile, backend, simplify, iterative, len(self), generation)
+
     def expand(
         self, profile, backend=None, simplify=True, ontology_graph=None, iterative=True
     ):
@@ -238,28 +355,64 @@ class BrickBase(rdflib.Graph):
             g.expand(profile='rdfs+shacl') # performs RDFS inference, then SHACL-AF inference
             g.expand(profile='shacl+rdfs') # performs SHACL-AF inference, then RDFS inference
 
-
-        # TODO: currently nothing is cached between expansions
+        If the graph has not changed since the last call to expand() with the same
+        arguments, the expansion is skipped. This only applies to the 'rdfs', 'owlrl'
+        and 'vbis' profiles, which always compute their full result.
         """
+        sig = self._expand_signature(
+            profile, backend, simplify, ontology_graph, iterative
+        )
+        if sig is not None and sig == getattr(self, "_last_expand_sig", None):
+            return self
+        res = self._expand(
+            profile,
+            backend=backend,
+            simplify=simplify,
+            ontology_graph=ontology_graph,
+            iterative=iterative,
+        )
+        # record the signature *after* expanding so that the inferred triples
+        # are part of the state we compare against on the next call
+        self._last_expand_sig = self._expand_signature(
+            profile, backend, simplify, ontology_graph, iterative
+        )
+        return res
+
+    def _expand(
+        self,
+        profile,
+        backend=None,
+        simplify=True,
+        ontology_graph=None,
+        iterative=True,
+        _skolemized=False,
+    ):
         og = None
         if ontology_graph:
-            og = ontology_graph.skolemize()
+            # all stages of a '+'-joined profile share one skolemized copy
+            og = ontology_graph if _skolemized else ontology_graph.skolemize()
 
         if "+" in profile:
             for prf in profile.split("+"):
-                self.expand(
-                    prf,
-                    backend=backend,
-                    simplify=simplify,
-                    ontology_graph=og,
-                    iterative=iterative,
-                )
+                if og is not None:
+                    self._expand(
+                        prf,
+                        backend=backend,
+                        simplify=simplify,
+                        ontology_graph=og,
+                        iterative=iterative,
+                        _skolemized=True,
+                    )
+                else:
+                    self.expand(
+                        prf, backend=backend, simplify=simplify, iterative=iterative
+                    )
             return
 
         if profile == "brick":
             return self.expand("owlrl+shacl+owlrl", backend=backend, simplify=simplify)
         elif profile == "rdfs":
-            owlrl.DeductiveClosure(owlrl.RDFS_Semantics).expand(self)
+            self._expand_rdfs()
             return
         elif profile == "shacl":
             if backend == "topquadrant":
@@ -280,6 +433,8 @@ class BrickBase(rdflib.Graph):
                 self.remove((None, None, None))
                 self += res
                 return self
+            import pyshacl
+
             valid, _, report = pyshacl.validate(
                 data_graph=self,
                 shacl_graph=og,
@@ -295,26 +450,73 @@ class BrickBase(rdflib.Graph):
                 self._iterative_expand(og)
             return self
         elif profile == "owlrl":
-            if backend is None:
-                backend = "reasonable"
-            if backend == "reasonable":
-                self._inferbackend = OWLRLReasonableInferenceSession()
-            elif backend == "allegrograph":
-                self._inferbackend = OWLRLAllegroInferenceSession()
-            elif backend == "owlrl":
-                self._inferbackend = OWLRLNaiveInferenceSession()
+            self._inferbackend = self._owlrl_session(backend)
         elif profile == "vbis":
+            from .inference import VBISTagInferenceSession
+
             self._inferbackend = VBISTagInferenceSession(
                 brick_version=self._brick_version
             )
         else:
             raise Exception(f"Invalid profile '{profile}'")
-        OWLRLNaiveInferenceSession().expand(self)
+        self._inferbackend.expand(self)
 
         if simplify:
             self.simplify()
         return self
 
+    def _expand_rdfs(self):
+        """
+        Computes the RDFS closure of this graph in place
+        """
+        import owlrl
+        from .inference import _cached_brick_closure
+
+        if (
+            isinstance(self, Graph)
+            and self._load_brick
+            and not self._load_brick_nightly
+        ):
+            # start from the RDFS closure of the packaged Brick, if it is cached
+            closure = _cached_brick_closure(self._brick_version, "rdfs")
+            if closure is not None:
+                self.addN((s, p, o, self) for (s, p, o) in closure)
+        owlrl.DeductiveClosure(owlrl.RDFS_Semantics).expand(self)
+
+    def _owlrl_session(self, backend):
+        """
+        Returns the inference session implementing the given OWLRL backend
+
+        Args:
+            backend (str): one of "reasonable", "allegrograph" or "owlrl"; if None,
+                "reasonable" is used when it is installed
+        """
+        from .inference import (
+            OWLRLNaiveInferenceSession,
+            OWLRLReasonableInferenceSession,
+            OWLRLAllegroInferenceSession,
+        )
+
+        if backend is None:
+            if _HAS_REASONABLE:
+                backend = "reasonable"
+            else:
+                warn(
+                    "'reasonable' package not found; falling back to the native-Python \
+OWLRL reasoner, which can be very slow. Install the reasonable reasoner with \
+'pip install brickschema[reasonable]'"
+                )
+                backend = "owlrl"
+        if backend == "reasonable":
+            return OWLRLReasonableInferenceSession()
+        elif backend == "allegrograph":
+            return OWLRLAllegroInferenceSession()
+        if backend != "owlrl":
+            warn(
+                f"Unknown OWLRL backend '{backend}'; using the native-Python OWLRL reasoner"
+            )
+        return OWLRLNaiveInferenceSession()
+
     def simplify(self):
         """
         Removes redundant and axiomatic triples and other detritus that is produced as a side effect of reasoning.
@@ -344,7 +546,9 @@ class GraphCollection(rdflib.Dataset, BrickBase):
         **kwargs,
     ):
         """Wrapper class and convenience methods for handling Brick models
-        and graphs. Accepts the same arguments as RDFlib.Graph
+        and graphs. Accepts the same arguments as RDFlib.Graph; for instance,
+        store="Oxigraph" keeps the triples in the Rust-based Oxigraph store
+        provided by the oxrdflib package, which is much faster on large models
 
         Args:
             load_brick (bool): if True, loads packaged Brick ontology
@@ -407,8 +611,7 @@ class GraphCollection(rdflib.Dataset, BrickBase):
         else:
             graph_name = rdflib.URIRef(graph_name)
         g = self.graph(graph_name)
-        for (s, p, o) in graph.triples((None, None, None)):
-            g.add((s, p, o))
+        g.addN((s, p, o, g) for (s, p, o) in graph)
         return g
 
     def remove_graph(self, graph_name):
@@ -434,14 +637,11 @@ class GraphCollection(rdflib.Dataset, BrickBase):
                 graph_name="https://brickschema.org/schema/Brick#",
             )
         elif self._load_brick:
-            # get ontology data from package
-            data = pkgutil.get_data(
-                __name__, f"ontologies/{self._brick_version}/Brick.ttl"
-            ).decode()
-            # wrap in StringIO to make it file-like
+            # get ontology data from package; parsed once per process
             self.load_graph(
-                source=io.StringIO(data),
-                format="turtle",
+                graph=_parse_packaged_ontology(
+                    f"ontologies/{self._brick_version}/Brick.ttl"
+                ),
                 graph_name="https://brickschema.org/schema/Brick#",
             )
 
@@ -469,9 +669,7 @@ class GraphCollection(rdflib.Dataset, BrickBase):
         alignment_path = os.path.join(
             "ontologies", self._brick_version, "alignments", alignment_name
         )
-        data = pkgutil.get_data(__name__, alignment_path).decode()
-        # wrap in StringIO to make it file-like
-        self.load_graph(source=io.StringIO(data), format="turtle")
+        self.load_graph(graph=_parse_packaged_ontology(alignment_path))
 
     def load_extension(self, extension_name):
         """
@@ -482,9 +680,7 @@ class GraphCollection(rdflib.Dataset, BrickBase):
         extension_path = os.path.join(
             "ontologies", self._brick_version, "extensions", extension_name
         )
-        data = pkgutil.get_data(__name__, extension_path).decode()
-        # wrap in StringIO to make it file-like
-        self.load_graph(source=io.StringIO(data), format="turtle")
+        self.load_graph(graph=_parse_packaged_ontology(extension_path))
 
     def contexts(self, triple=None):
         """Iterate over all contexts in the graph
@@ -514,7 +710,9 @@ class Graph(BrickBase):
         **kwargs,
     ):
         """Wrapper class and convenience methods for handling Brick models
-        and graphs. Accepts the same arguments as RDFlib.Graph
+        and graphs. Accepts the same arguments as RDFlib.Graph; for instance,
+        store="Oxigraph" keeps the triples in the Rust-based Oxigraph store
+        provided by the oxrdflib package, which is much faster on large models
 
         Args:
             load_brick (bool): if True, loads packaged Brick ontology
@@ -530,6 +728,11 @@ class Graph(BrickBase):
             A Graph object
         """
         super().__init__(*args, **kwargs)
+        # bumped on every modification; used to detect an unchanged graph
+        self._generation = 0
+        self._last_expand_sig = None
+        # (len(self), _generation) -> the nodes of the graph; see nodes
+        self._nodes_cache = (None, frozenset())
         self._brick_version = brick_version
         self._load_brick = load_brick
         self._load_brick_nightly = load_brick_nightly
@@ -550,12 +753,8 @@ class Graph(BrickBase):
                 format="turtle",
             )
         elif self._load_brick:
-            # get ontology data from package
-            data = pkgutil.get_data(
-                __name__, f"ontologies/{self._brick_version}/Brick.ttl"
-            ).decode()
-            # wrap in StringIO to make it file-like
-            self.load_file(source=io.StringIO(data), format="turtle")
+            # get ontology data from package; parsed once per process
+            self._add_packaged_ontology(f"ontologies/{self._brick_version}/Brick.ttl")
 
         self._tagbackend = None
 
@@ -569,15 +768,31 @@ class Graph(BrickBase):
         """
         if filename is not None:
             fmt = format if format else rdflib.util.guess_format(filename)
+            # Turtle files that only contain N-Triples statements can use the
+            # much simpler (and faster) N-Triples parser. Only the start of the
+            # file is checked, so fall back to Turtle if the rest is not N-Triples
+            if format is None and fmt == "turtle" and _is_ntriples_file(filename):
+                triples = _read_ntriples(filename)
+                if triples is not None:
+                    self.addN((s, p, o, self) for (s, p, o) in triples)
+                    return self
             self.parse(filename, format=fmt)
         elif source is not None:
-            for fmt in [format, "ttl", "n3", "xml"]:
+            # try the given (or guessed) format first, then the others in turn
+            first = format if format else _guess_source_format(source)
+            formats = [first] if first else []
+            formats += [f for f in ["turtle", "n3", "xml"] if f != first]
+            seekable = _is_seekable(source)
+            pos = source.tell() if seekable else None
+            for fmt in formats:
                 try:
                     self.parse(source=source, format=fmt)
                     return self
                 except Exception as e:
-                    warn(f"could not load {filename} as {fmt}: {e}")
-            raise Exception(f"unknown file format for {filename}")
+                    warn(f"could not load {source} as {fmt}: {e}")
+                    if seekable:
+                        source.seek(pos)
+            raise Exception(f"unknown file format for {source}")
         else:
             raise Exception(
                 "Must provide either a filename or file-like\
@@ -611,6 +826,7 @@ source to load_file"
 
         Otherwise, acts the same as rdflib.Graph.add
         """
+        self._generation += 1
         for triple in triples:
             assert len(triple) == 3
             obj = triple[2]
@@ -624,15 +840,43 @@ source to load_file"
             else:
                 super().add(triple)
 
+    def addN(self, quads):
+        """
+        Adds a sequence of quads to the graph. Acts the same as rdflib.Graph.addN
+        """
+        self._generation += 1
+        return super().addN(quads)
+
+    def remove(self, triple):
+        """
+        Removes a triple (or pattern) from the graph. Acts the same as rdflib.Graph.remove
+        """
+        self._generation += 1
+        return super().remove(triple)
+
+    def parse(self, *args, **kwargs):
+        """
+        Parses an RDF source into the graph. Acts the same as rdflib.Graph.parse
+        """
+        # some parsers write to the store directly rather than through add()
+        self._generation += 1
+        return super().parse(*args, **kwargs)
+
     @property
     def nodes(self):
         """
-        Returns all nodes in the graph
+        Returns all nodes in the graph. The store is only rescanned if the graph
+        has changed since the last call; each call returns a new set
 
         Returns:
-            nodes (list of rdflib.URIRef): nodes in the graph
+            nodes (set of rdflib.URIRef): nodes in the graph
         """
-        return self.all_nodes()
+        key = (len(self), self._generation)
+        cached_key, nodes = self._nodes_cache
+        if cached_key != key:
+            nodes = frozenset(self.all_nodes())
+            self._nodes_cache = (key, nodes)
+        return set(nodes)
 
     def from_haystack(self, namespace, model):
         """
@@ -642,8 +886,10 @@ source to load_file"
         Args:
             model (dict): a Haystack model
         """
+        from .inference import HaystackInferenceSession
+
         sess = HaystackInferenceSession(namespace)
-        self.add(*sess.infer_model(model))
+        self.addN((s, p, o, self) for s, p, o in sess.infer_model(model))
         return self
 
     def from_triples(self, triples):
@@ -665,9 +911,7 @@ source to load_file"
         alignment_path = os.path.join(
             "ontologies", self._brick_version, "alignments", alignment_name
         )
-        data = pkgutil.get_data(__name__, alignment_path).decode()
-        # wrap in StringIO to make it file-like
-        self.load_file(source=io.StringIO(data), format="turtle")
+        self._add_packaged_ontology(alignment_path)
 
     def load_extension(self, extension_name):
         """
@@ -678,6 +922,227 @@ source to load_file"
         extension_path = os.path.join(
             "ontologies", self._brick_version, "extensions", extension_name
         )
-        data = pkgutil.get_data(__name__, extension_path).decode()
-        # wrap in StringIO to make it file-like
-        self.load_file(source=io.StringIO(data), format="turtle")
+        self._add_packaged_ontology(extension_path)
+
+    def _add_packaged_ontology(self, path):
+        """
+        Adds the triples and prefix bindings of a Turtle file packaged with
+        brickschema to the graph. The file is only parsed once per process
+        """
+        parsed = _parse_packaged_ontology(path)
+        self.addN((s, p, o, self) for s, p, o in parsed)
+        # most of these prefixes (brick, rdfs, owl, ...) are usually bound already
+        bound = set(self.namespaces())
+        for prefix, namespace in parsed.namespaces():
+            if (prefix, namespace) not in bound:
+                self.bind(prefix, namespace, override=False)
+
+
+@functools.lru_cache(maxsize=256)
+def _prepare_query(querystring, namespaces):
+    """
+    Parses and translates a SPARQL query. The result is cached, so repeated queries
+    skip the (slow) SPARQL parser
+
+    Args:
+        querystring (str): the SPARQL query
+        namespaces (tuple of (str, rdflib.URIRef)): prefix bindings for the query
+
+    Returns:
+        query (rdflib.plugins.sparql.sparql.Query): the prepared query
+    """
+    from rdflib.plugins.sparql import prepareQuery
+
+    return prepareQuery(querystring, initNs=dict(namespaces))
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_packaged_ontology(path):
+    """
+    Parses a Turtle file packaged with brickschema (e.g. Brick, an alignment or an extension).
+    The result is cached, so each file is only parsed once per process. The returned
+    graph is shared and must not be modified
+
+    Args:
+        path (str): path of the file relative to the brickschema package
+
+    Returns:
+        graph (rdflib.Graph): the parsed file
+    """
+    data = pkgutil.get_data(__name__, path)
+    # Turtle parsing is slow, so keep an N-Triples copy of the file in the cache
+    # directory. N-Triples has no prefixes; they are stored as leading comments
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_file = _cache_path(f"{name}-{digest}.nt")
+
+    g = rdflib.Graph(bind_namespaces="none")
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached = f.read()
+            for line in cached.splitlines():
+                if not line.startswith(b"#prefix "):
+                    break
+                prefix, namespace = line.decode("utf-8").split()[1:3]
+                g.bind(prefix[:-1], rdflib.URIRef(namespace))
+            g.parse(data=cached, format="nt")
+            return g
+        except Exception as e:
+            logger.warning(f"Could not read cached ontology {cache_file}: {e}")
+            g = rdflib.Graph(bind_namespaces="none")
+
+    g.parse(source=io.BytesIO(data), format="turtle")
+    prefixes = "".join(
+        f"#prefix {pfx}: {namespace}\n" for pfx, namespace in g.namespaces()
+    )
+    _write_cache_file(
+        cache_file,
+        prefixes.encode("utf-8") + g.serialize(format="nt", encoding="utf-8"),
+    )
+    return g
+
+
+def _cache_dir():
+    """
+    Returns the directory used to cache derived data (e.g. parsed ontologies, inferred
+    triples) between runs, or None if there is none. Nothing is cached on disk unless
+    the BRICKSCHEMA_CACHE_DIR environment variable names a directory
+    """
+    return os.environ.get("BRICKSCHEMA_CACHE_DIR") or None
+
+
+def _cache_path(name):
+    """
+    Returns the path of the named file in the cache directory, or None if the
+    on-disk cache is off (see _cache_dir)
+
+    Args:
+        name (str): name of the cache file
+
+    Returns:
+        path (str): path of the cache file, or None
+    """
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, name)
+
+
+def _write_cache_file(cache_file, data):
+    """
+    Writes the given bytes to a file in the cache directory. The file is written under
+    a temporary name and then moved into place, so concurrent readers never see a
+    partially-written file. Failures (e.g. a read-only directory) are logged and
+    otherwise ignored
+
+    Args:
+        cache_file (str): path of the file to write; nothing is written if None
+        data (bytes): contents of the file
+    """
+    if cache_file is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{secrets.token_hex(4)}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.info(f"Could not write cache file {cache_file}: {e}")
+
+
+def _is_seekable(source):
+    """
+    Returns True if the given file-like object can be rewound with seek()
+    """
+    return hasattr(source, "seek") and getattr(source, "seekable", lambda: False)()
+
+
+def _guess_source_format(source):
+    """
+    Guesses the RDF serialization of a file-like object by looking at its
+    first bytes, then rewinds the object so it can be parsed. This is only a
+    first guess; load_file falls back to the other formats if it is wrong
+
+    Args:
+        source (file): file-like object
+
+    Returns:
+        format (str): one of 'xml', 'turtle' or 'n3', or None if the object
+            cannot be rewound (and so cannot be looked at)
+    """
+    if not hasattr(source, "read") or not _is_seekable(source):
+        return None
+    pos = source.tell()
+    head = source.read(512)
+    source.seek(pos)
+    if isinstance(head, str):
+        head = head.encode("utf-8", errors="ignore")
+    head = head.lstrip()
+    if head.startswith((b"<?xml", b"<!", b"<rdf:RDF")) or b"<rdf:RDF" in head:
+        return "xml"
+    if any(kw in head for kw in (b"@prefix", b"@base", b"PREFIX", b"BASE")):
+        return "turtle"
+    # N3 is a superset of Turtle, so it also covers Turtle files whose
+    # prefix declarations do not appear at the top
+    return "n3"
+
+
+def _is_ntriples_file(filename):
+    """
+    Returns True if the given local file looks like N-Triples: every complete line in
+    its first few kilobytes is an N-Triples statement, a comment or blank. The rest of
+    the file is not checked; see _read_ntriples
+
+    Args:
+        filename (str): path to the file
+
+    Returns:
+        is_ntriples (bool): True if the file can likely be parsed as N-Triples
+    """
+    if not os.path.isfile(filename):
+        return False
+    try:
+        with open(filename, "rb") as f:
+            head = f.read(_NT_PROBE_SIZE + 1)
+        if len(head) > _NT_PROBE_SIZE:
+            # leave out the last line, which may be cut off
+            head = head[:_NT_PROBE_SIZE].rsplit(b"\n", 1)[0]
+        lines = head.decode("utf-8").splitlines()
+    except (OSError, UnicodeDecodeError):
+        return False
+    return all(_NT_LINE.fullmatch(line) for line in lines)
+
+
+class _TripleList(list):
+    """
+    N-Triples parser sink that collects the parsed triples
+    """
+
+    def triple(self, s, p, o):
+        self.append((s, p, o))
+
+
+def _read_ntriples(filename):
+    """
+    Parses the given local file as N-Triples. The parser reads the file line by
+    line and gives up at the first line that is not N-Triples. Triples are only
+    returned once the whole file has parsed, so a caller that falls back to
+    another parser has nothing to undo
+
+    Args:
+        filename (str): path to the file
+
+    Returns:
+        triples (list): the parsed triples, or None if the file is not N-Triples
+    """
+    from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+    triples = _TripleList()
+    try:
+        with open(filename, "rb") as f:
+            W3CNTriplesParser(triples).parse(f)
+    except rdflib.exceptions.ParserError:
+        return None
+    return triples
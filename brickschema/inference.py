@@ -1,23 +1,84 @@
 import logging
 import time
-import tempfile
-import itertools
+import functools
 import csv
 import secrets
 import re
 import pkgutil
 import io
-import pickle
+import os
+import hashlib
+import json
+import locale
 from collections import defaultdict
-from .namespaces import BRICK, A, RDFS
+from .namespaces import BRICK, A, RDFS, SH
 import rdflib
 from .tagmap import tagmap
-import owlrl
 import tarfile
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# (brick version, semantics) -> the inferred triples over the packaged Brick; see
+# cache_brick_closure
+_brick_closures = {}
+
+# fingerprint of an input graph -> the triples reasonable produced for it; see
+# OWLRLReasonableInferenceSession.expand and set_closure_cache_size. Off by default
+_reasonable_closures = {}
+_closure_cache_max_triples = 0
+
+# terms used once per entity by the Haystack inference; a Namespace attribute
+# lookup builds a new URIRef each time
+_BRICK_SITE = BRICK.Site
+_BRICK_HAS_POINT = BRICK.hasPoint
+_RDFS_LABEL = RDFS.label
+
+# the default HaystackInferenceSession._filters: Haystack marker tags that
+# are not used for inference
+_HAYSTACK_FILTERS = [
+    lambda x: not x.startswith("his"),
+    lambda x: not x.endswith("Ref"),
+    lambda x: not x.startswith("cur"),
+    lambda x: x != ("disMacro"),
+    lambda x: x != "navName",
+    lambda x: x != "tz",
+    lambda x: x != "mod",
+    lambda x: x != "id",
+]
+
+
+def set_closure_cache_size(max_triples):
+    """
+    Sets how many inferred triples the 'reasonable' OWLRL backend may keep in memory
+    so that expanding a graph with the same triples again (e.g. a fresh copy of the
+    same model) does not rerun the reasoner. The oldest results are dropped first.
+    The cache is off (0) by default
+
+    Args:
+        max_triples (int): total number of cached triples; 0 turns the cache off
+    """
+    global _closure_cache_max_triples
+    _closure_cache_max_triples = max(0, int(max_triples))
+    _shrink_closure_cache(_closure_cache_max_triples)
+
+
+def clear_closure_cache():
+    """
+    Drops all results kept by the 'reasonable' OWLRL backend; see set_closure_cache_size
+    """
+    _reasonable_closures.clear()
+
+
+def _shrink_closure_cache(max_triples):
+    """
+    Drops the oldest cached closures until at most max_triples triples are cached
+    """
+    total = sum(len(triples) for triples in _reasonable_closures.values())
+    while _reasonable_closures and total > max_triples:
+        oldest = next(iter(_reasonable_closures))
+        total -= len(_reasonable_closures.pop(oldest))
+
 
 class OWLRLNaiveInferenceSession:
     """
@@ -27,11 +88,25 @@ class OWLRLNaiveInferenceSession:
 
     def expand(self, graph):
         """
-        Applies OWLRL reasoning from the Python owlrl library to the graph
+        Applies OWLRL reasoning from the Python owlrl library to the graph.
+        If the graph contains the packaged Brick ontology and the inferences over
+        Brick itself have been cached (see cache_brick_closure), they are added
+        first so the reasoner converges in fewer passes
 
         Args:
             graph (brickschema.graph.Graph): a Graph object containing triples
         """
+        import owlrl
+        from .graph import Graph
+
+        if (
+            isinstance(graph, Graph)
+            and graph._load_brick
+            and not graph._load_brick_nightly
+        ):
+            closure = _cached_brick_closure(graph._brick_version)
+            if closure is not None:
+                graph.addN((s, p, o, graph) for (s, p, o) in closure)
         owlrl.DeductiveClosure(owlrl.OWLRL_Semantics).expand(graph)
 
 
@@ -57,14 +132,27 @@ Currently only works on Linux and MacOS"
 
     def expand(self, graph):
         """
-        Applies OWLRL reasoning from the Python reasonable library to the graph
+        Applies OWLRL reasoning from the Python reasonable library to the graph.
+        If the closure cache is on (see set_closure_cache_size) and a graph with
+        the same triples was reasoned over recently in this process, the earlier
+        result is added without running the reasoner
 
         Args:
             graph (brickschema.graph.Graph): a Graph object containing triples
         """
-        self.r.from_graph(graph)
-        triples = self.r.reason()
-        graph.add(*triples)
+        if _closure_cache_max_triples == 0:
+            self.r.from_graph(graph)
+            triples = self.r.reason()
+        else:
+            fingerprint = _graph_fingerprint(graph)
+            triples = _reasonable_closures.get(fingerprint)
+            if triples is None:
+                self.r.from_graph(graph)
+                triples = tuple(self.r.reason())
+                if len(triples) <= _closure_cache_max_triples:
+                    _shrink_closure_cache(_closure_cache_max_triples - len(triples))
+                    _reasonable_closures[fingerprint] = triples
+        graph.addN((s, p, o, graph) for (s, p, o) in triples)
 
 
 class OWLRLAllegroInferenceSession:
@@ -75,13 +163,20 @@ class OWLRLAllegroInferenceSession:
     Uses the Allegrograph reasoning implementation
     """
 
-    def __init__(self):
+    def __init__(self, reuse_container=False):
         """
         Creates a new OWLRL Inference session backed by the Allegrograph
         reasoner (https://franz.com/agraph/support/documentation/current/materializer.html).
         Requires the docker package to work; recommended method of installing
         is to use the 'allegro' option with pip:
             pip install brickschema[allegro]
+
+        Args:
+            reuse_container (bool): if True, the Allegrograph container is started on
+                the first call to expand() and kept running for later calls, which
+                avoids paying the container startup cost every time. Call close()
+                to stop it. If False, each call to expand() starts and stops its
+                own container
         """
 
         try:
@@ -100,46 +195,41 @@ for Allegro with 'pip install brickschema[allegro]"
             )
             raise ConnectionError(e)
         self._container_name = f"agraph-{secrets.token_hex(8)}"
+        self._reuse_container = reuse_container
+        self._agraph = None
         logger.info(f"container will be {self._container_name}")
 
     def _setup_input(self, g):
         """
-        Add our serialized graph to an in-memory tar file
-        that we can send to Docker
+        Add our graph, serialized as N-Triples, to an in-memory gzipped tar
+        file that we can send to Docker
         """
+        data = g.serialize(format="nt", encoding="utf-8")
         tarbytes = io.BytesIO()
-        with tempfile.NamedTemporaryFile() as f:
-            g.serialize(f.name, format="turtle")
-            tar = tarfile.open(name="out.tar", mode="w", fileobj=tarbytes)
-            tar.add(f.name, arcname="input.ttl")
-            tar.close()
+        with tarfile.open(mode="w:gz", fileobj=tarbytes) as tar:
+            info = tarfile.TarInfo(name="input.nt")
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
         # seek to beginning so our file is not empty when docker sees it
         tarbytes.seek(0)
         return tarbytes
 
-    def expand(self, graph):
+    @staticmethod
+    def _check_error(res):
+        exit_code, message = res
+        exit_code == int(exit_code)
+        if exit_code == 0:
+            return
+        elif exit_code == 1:  # critical
+            raise Exception(f"Non-zero exit code {exit_code} with message {message}")
+        elif exit_code == 2:  # problematic, but can continue
+            logging.error(f"Non-zero exit code {exit_code} with message {message}")
+
+    def _start_container(self):
         """
-        Applies OWLRL reasoning from the Python owlrl library to the graph
-
-        Args:
-            graph (brickschema.graph.Graph): a Graph object containing triples
+        Starts the Allegrograph container and waits until the server is up
         """
-
-        def check_error(res):
-            exit_code, message = res
-            exit_code == int(exit_code)
-            if exit_code == 0:
-                return
-            elif exit_code == 1:  # critical
-                raise Exception(
-                    f"Non-zero exit code {exit_code} with message {message}"
-                )
-            elif exit_code == 2:  # problematic, but can continue
-                logging.error(f"Non-zero exit code {exit_code} with message {message}")
-
-        logger.debug("setup inputs to docker + connection")
-        # setup connection to docker
-        tar = self._setup_input(graph)
         logger.debug("run agraph container")
         agraph = self._client.containers.run(
             "franzinc/agraph:v7.1.0",
@@ -148,10 +238,6 @@ for Allegro with 'pip install brickschema[allegro]"
             shm_size="1G",
             remove=True,
         )
-        logger.debug("should be started; copying input to container")
-        if not agraph.put_archive("/tmp", tar):
-            print("Could not add input.ttl to docker container")
-        check_error(agraph.exec_run("chown -R agraph /tmp", user="root"))
 
         # wait until agraph.cfg is created
         logger.debug("checking agraph cfg")
@@ -169,6 +255,54 @@ for Allegro with 'pip install brickschema[allegro]"
             exit_code, _ = agraph.exec_run(
                 "/agraph/bin/agraph-control --config /agraph/etc/agraph.cfg status"
             )
+        return agraph
+
+    def close(self):
+        """
+        Stops the Allegrograph container kept running by a session created
+        with reuse_container=True. Does nothing if no container is running
+        """
+        if self._agraph is not None:
+            logger.debug("stopping container + removing")
+            # container will automatically remove when stopped
+            self._agraph.stop()
+            self._agraph = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def expand(self, graph):
+        """
+        Applies OWLRL reasoning from the Python owlrl library to the graph
+
+        Args:
+            graph (brickschema.graph.Graph): a Graph object containing triples
+        """
+        check_error = self._check_error
+
+        logger.debug("setup inputs to docker + connection")
+        # setup connection to docker
+        tar = self._setup_input(graph)
+        if self._agraph is not None:
+            agraph = self._agraph
+            # clear out the files from the previous run
+            check_error(
+                agraph.exec_run("rm -f /tmp/input.nt /tmp/output.nt", user="root")
+            )
+        else:
+            agraph = self._start_container()
+            if self._reuse_container:
+                self._agraph = agraph
+        logger.debug("should be started; copying input to container")
+        if not agraph.put_archive("/tmp", tar):
+            logger.error("Could not add input.nt to docker container")
+            if not self._reuse_container:
+                agraph.stop()
+            raise Exception("Could not add input.nt to docker container")
+        check_error(agraph.exec_run("chown -R agraph /tmp", user="root"))
 
         # check_error(
         #    agraph.exec_run(
@@ -176,10 +310,11 @@ for Allegro with 'pip install brickschema[allegro]"
         #        user="agraph",
         #    )
         # )
+        # --supersede replaces the 'test' repository left over from an earlier run
         check_error(
             agraph.exec_run(
-                "/agraph/bin/agload test \
-/tmp/input.ttl",
+                "/agraph/bin/agload --supersede --input ntriples test \
+/tmp/input.nt",
                 user="agraph",
             ),
         )
@@ -192,26 +327,24 @@ for Allegro with 'pip install brickschema[allegro]"
         )
         check_error(
             agraph.exec_run(
-                "/agraph/bin/agexport -o turtle test\
- /tmp/output.ttl",
+                "/agraph/bin/agexport -o ntriples test\
+ /tmp/output.nt",
                 user="agraph",
             )
         )
         logger.debug("retrieving archive")
-        bits, _ = agraph.get_archive("/tmp/output.ttl")
+        bits, _ = agraph.get_archive("/tmp/output.nt")
 
-        with tempfile.NamedTemporaryFile() as f:
-            for chunk in bits:
-                f.write(chunk)
-            f.seek(0)
-            with tarfile.open(fileobj=f) as tar:
-                out = tar.extractfile("output.ttl")
-                graph.parse(out, format="ttl")
-                # tar.extractall()
+        # read the archive in memory and parse the output straight out of it
+        archive = io.BytesIO(b"".join(bits))
+        with tarfile.open(fileobj=archive) as tar:
+            out = tar.extractfile("output.nt")
+            graph.parse(source=out, format="nt")
 
-        logger.debug("stopping container + removing")
-        # container will automatically remove when stopped
-        agraph.stop()
+        if not self._reuse_container:
+            logger.debug("stopping container + removing")
+            # container will automatically remove when stopped
+            agraph.stop()
 
 
 class VBISTagInferenceSession:
@@ -243,15 +376,22 @@ class VBISTagInferenceSession:
         if self._alignment_file is None:
             self._graph.load_alignment("VBIS")
         else:
-            self._graph.load_file(self._alignment_file)
+            path = os.path.abspath(self._alignment_file)
+            alignment = _parse_alignment_file(path, os.path.getmtime(path))
+            self._graph.addN((s, p, o, self._graph) for (s, p, o) in alignment)
+            for prefix, namespace in alignment.namespaces():
+                self._graph.bind(prefix, namespace, override=False)
 
         if self._master_list_file is None:
-            data = pkgutil.get_data(
+            master_list = pkgutil.get_data(
                 __name__, f"ontologies/{brick_version}/vbis-masterlist.csv"
-            ).decode()
-            master_list_file = io.StringIO(data)
+            )
+            encoding = "utf-8"
         else:
-            master_list_file = open(self._master_list_file)
+            with open(self._master_list_file, "rb") as f:
+                master_list = f.read()
+            # what open() would have decoded the file with
+            encoding = locale.getpreferredencoding(False)
 
         # query the graph for all VBIS patterns that are linked to Brick classes
         # Build a lookup table from the results
@@ -270,17 +410,25 @@ class VBISTagInferenceSession:
             brickclass, vbispattern = row
             self._pattern2class[vbispattern].append(brickclass)
             self._class2pattern[brickclass] = vbispattern
+        # the patterns, compiled once for all the lookups below
+        self._compiled_patterns = [
+            (re.compile(pattern), pattern) for pattern in self._pattern2class.keys()
+        ]
+        # matches if any one of the patterns does. The patterns overlap (a tag can
+        # match a class's pattern and its parent's), so this only rules tags out;
+        # the individual patterns still decide which ones match
+        self._any_pattern = _combine_patterns(self._pattern2class.keys())
 
         # Build a lookup table of VBIS pattern -> VBIS tag. The VBIS patterns
         # used as keys are from the above lookup table, so they all correspond
         # to a Brick class
+        matches = _match_vbis_tags(
+            self._compiled_patterns, self._any_pattern, master_list, encoding
+        )
         self._pattern2vbistag = defaultdict(list)
-        rdr = csv.DictReader(master_list_file)
-        for row in rdr:
-            for pattern in self._pattern2class.keys():
-                if re.match(pattern, row["VBIS Tag"]):
-                    self._pattern2vbistag[pattern].append(row["VBIS Tag"])
-        master_list_file.close()
+        for pattern in self._pattern2class.keys():
+            if str(pattern) in matches:
+                self._pattern2vbistag[pattern] = matches[str(pattern)]
 
     def expand(self, graph):
         """
@@ -293,54 +441,69 @@ class VBISTagInferenceSession:
         )
         graph += self._graph
 
-        equip_and_shape = graph.query(
-            """SELECT ?equip ?class ?shape WHERE {
-             ?class rdfs:subClassOf* brick:Equipment .
-             ?equip rdf:type ?class .
-             ?shape sh:targetClass ?class .
-        }"""
-        )
-        equips = set([row[0] for row in equip_and_shape])
-        for equip in equips:
-            rows = [row for row in equip_and_shape if row[0] == equip]
-            classes = set([row[1] for row in rows])
-            brickclass = self._filter_to_most_specific(graph, classes)
+        # equivalent to
+        #   ?class rdfs:subClassOf* brick:Equipment .
+        #   ?equip rdf:type ?class .
+        #   ?shape sh:targetClass ?class .
+        # but without joining in ?shape, which is not needed: only the classes
+        # that are the target of some shape are kept
+        brick = rdflib.Namespace(graph.store.namespace("brick") or BRICK)
+        shaped_classes = set(graph.objects(None, SH.targetClass))
+        # the classes of each equipment, in the order the subclass walk from
+        # brick:Equipment reaches them (dicts keep _filter_to_most_specific's
+        # tie-break independent of hash order)
+        equip_classes = defaultdict(dict)
+        for klass in _ordered_subclasses(graph, brick.Equipment):
+            if klass not in shaped_classes:
+                continue
+            for equip in graph.subjects(A, klass):
+                equip_classes[equip][klass] = None
+        # class -> its subclasses, shared by all the equipment below
+        subclasses = {}
+        has_vbis_tag = ALIGN.hasVBISTag
+        # the VBIS tags of all the equipment; added to the graph in one batch
+        inferred = []
+        for equip, classes in equip_classes.items():
+            brickclass = self._filter_to_most_specific(graph, classes, subclasses)
             applicable_vbis = self._pattern2vbistag[self._class2pattern[brickclass]]
             if len(applicable_vbis) == 1:
-                graph.add((equip, ALIGN.hasVBISTag, rdflib.Literal(applicable_vbis[0])))
+                inferred.append(
+                    (equip, has_vbis_tag, rdflib.Literal(applicable_vbis[0]))
+                )
             elif len(applicable_vbis) > 1:
                 common_pfx = _get_common_prefix(applicable_vbis)
-                graph.add((equip, ALIGN.hasVBISTag, rdflib.Literal(common_pfx)))
+                inferred.append((equip, has_vbis_tag, rdflib.Literal(common_pfx)))
             else:
                 logger.info(f"No VBIS tags found for {equip} with type {brickclass}")
+        graph.addN((s, p, o, graph) for (s, p, o) in inferred)
 
-    def _filter_to_most_specific(self, graph, classlist):
+    def _filter_to_most_specific(self, graph, classlist, subclass_cache=None):
         """
         Given a list of Brick classes (rdflib.URIRef), return the most specific one
-        (the one that is not a superclass of the others)
-        """
-        candidates = {}
-        for brickclass in classlist:
-            sc_query = f"SELECT ?subclass WHERE {{ ?subclass rdfs:subClassOf+ <{brickclass}> }}"
-            subclasses = set([x[0] for x in graph.query(sc_query)])
-            # if there are NO subclasses of 'brickclass', then it is specific
-            if len(subclasses) == 0:
-                candidates[brickclass] = 0
-                continue
-            # 'subclasses' are the subclasses of 'brickclass'. If any of these appear in
-            # 'classlist', then we know that 'brickclass' is not the most specific
-            intersection = set(classlist).intersection(subclasses)
-            if len(intersection) == 1 and brickclass in intersection:
-                candidates[brickclass] = 1
-            else:
-                candidates[brickclass] = len(intersection)
-        most_specific = None
-        mincount = float("inf")
-        for specific, score in candidates.items():
-            if score < mincount:
-                most_specific = specific
-                mincount = score
-        return most_specific
+        (the one that is not a superclass of the others), or the first of them in
+        classlist if there are several. If given, subclass_cache
+        (a dict of class -> set of subclasses) is used and filled in so the
+        subclasses of a class are only computed once
+        """
+        if subclass_cache is None:
+            subclass_cache = {}
+        classes = dict.fromkeys(classlist)
+        for brickclass in classes:
+            subclasses = subclass_cache.get(brickclass)
+            if subclasses is None:
+                # ?subclass rdfs:subClassOf+ brickclass
+                subclasses = graph._transitive_subjects(brickclass, [RDFS.subClassOf])
+                subclass_cache[brickclass] = subclasses
+            # the most specific class is the one none of the others are subclasses of
+            if not any(c in subclasses for c in classes if c != brickclass):
+                return brickclass
+        # every class has another one below it (a subclass cycle); take the
+        # one with the fewest
+        return min(
+            classes,
+            key=lambda brickclass: len(subclass_cache[brickclass] & classes.keys()),
+            default=None,
+        )
 
     def lookup_brick_class(self, vbistag):
         """
@@ -355,12 +518,98 @@ class VBISTagInferenceSession:
         if "*" in vbistag:
             raise Exception("Pattern search not supported in current release")
         classes = set()
-        for pattern, brickclasses in self._pattern2class.items():
-            if re.match(pattern, vbistag):
-                classes.update(brickclasses)
+        if self._any_pattern is not None and not self._any_pattern.match(vbistag):
+            return []
+        for regex, pattern in self._compiled_patterns:
+            if regex.match(vbistag):
+                classes.update(self._pattern2class[pattern])
         return list(classes)
 
 
+class _ClassSet(set):
+    """
+    The Brick class names of one entry of a _TagLookup. Changes are counted in
+    the version of the table
+    """
+
+    def __init__(self, classes, table):
+        super().__init__(classes)
+        self._table = table
+
+
+def _count_change(method):
+    """
+    Wraps a method of _TagLookup or _ClassSet so calls to it count as a change
+    to the lookup table
+    """
+
+    @functools.wraps(method)
+    def changed(self, *args, **kwargs):
+        table = self._table if isinstance(self, _ClassSet) else self
+        table.version += 1
+        return method(self, *args, **kwargs)
+
+    return changed
+
+
+for _name in [
+    "add",
+    "discard",
+    "remove",
+    "pop",
+    "clear",
+    "update",
+    "difference_update",
+    "intersection_update",
+    "symmetric_difference_update",
+    "__ior__",
+    "__iand__",
+    "__isub__",
+    "__ixor__",
+]:
+    setattr(_ClassSet, _name, _count_change(getattr(set, _name)))
+
+
+class _TagLookup(dict):
+    """
+    Tag lookup table of a TagInferenceSession: sorted tuple of tags -> set of
+    Brick class names. Like a defaultdict(set), missing entries are created on
+    access. Every change to the table or one of its sets increments version, so
+    the session knows when to rebuild its index
+    """
+
+    def __init__(self, table=()):
+        super().__init__()
+        self.version = 0
+        for tags, classes in dict(table).items():
+            super().__setitem__(tuple(tags), _ClassSet(classes, self))
+
+    def __setitem__(self, tags, classes):
+        self.version += 1
+        super().__setitem__(tags, _ClassSet(classes, self))
+
+    def __missing__(self, tags):
+        self[tags] = ()
+        return dict.__getitem__(self, tags)
+
+    def setdefault(self, tags, classes=()):
+        if tags not in self:
+            self[tags] = classes
+        return self[tags]
+
+    def update(self, *args, **kwargs):
+        for tags, classes in dict(*args, **kwargs).items():
+            self[tags] = classes
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+
+for _name in ["__delitem__", "pop", "popitem", "clear"]:
+    setattr(_TagLookup, _name, _count_change(getattr(dict, _name)))
+
+
 class TagInferenceSession:
     """
     Provides methods and an interface for inferring Brick classes from
@@ -375,6 +624,7 @@ class TagInferenceSession:
         rebuild_tag_lookup=False,
         approximate=False,
         brick_file=None,
+        store="default",
     ):
         """
         Creates new Tag Inference session
@@ -391,81 +641,112 @@ class TagInferenceSession:
                 version
             approximate (bool): if True, considers a more permissive set of
                 possibly related classes. If False, performs exact tag mapping
+            store (str or rdflib.store.Store): the rdflib store backing the session's
+                Brick graph, e.g. "Oxigraph" (requires the oxrdflib package).
+                Defaults to rdflib's in-memory store
         """
         from .graph import Graph
 
         if brick_file is not None:
-            self.g = Graph(load_brick=False)
+            self.g = Graph(store=store, load_brick=False)
             self.g.load_file(brick_file)
         else:
-            self.g = Graph(load_brick=load_brick, brick_version=brick_version)
+            self.g = Graph(
+                store=store, load_brick=load_brick, brick_version=brick_version
+            )
+        # the packaged Brick version in self.g, if that is all self.g holds
+        self._packaged_brick = (
+            brick_version if brick_file is None and load_brick else None
+        )
         self._approximate = approximate
+        # root class name -> names of its subclasses; see _class_names_under
+        self._subclass_names = {}
         if rebuild_tag_lookup:
             self._make_tag_lookup()
         else:
             # get ontology data from package
-            data = pkgutil.get_data(
-                __name__, f"ontologies/{brick_version}/taglookup.pickle"
-            )
-            # TODO: move on from moving pickle to something more secure?
-            self.lookup = pickle.loads(data)
+            self.lookup = _load_tag_lookup(brick_version)
+
+    @property
+    def lookup(self):
+        """
+        The tag lookup table: sorted tuple of tags -> set of Brick class names.
+        The table can be changed in place or replaced; the index used for matching
+        is rebuilt on the next lookup after a change
+        """
+        return self._lookup
+
+    @lookup.setter
+    def lookup(self, table):
+        # a copy of the table, so the shared packaged table is never changed
+        self._lookup = _TagLookup(table)
+        self._indexed_version = None
+
+    def _check_tag_index(self):
+        """
+        Rebuilds the index of the lookup table if the table changed since it was built
+        """
+        if self._indexed_version != self._lookup.version:
+            self._build_tag_index()
+            self._indexed_version = self._lookup.version
 
     def _make_tag_lookup(self):
         """
         Builds taglookup dictionary. You shouldn't need to do this unless
         the taglookup dictionary is out of date
         """
-        self.lookup = defaultdict(set)
-        res = self.g.query(
-            """SELECT ?class ?tag WHERE {
-          ?class rdfs:subClassOf+ brick:Class.
-          ?class brick:hasAssociatedTag ?tag .
-          ?tag rdf:type brick:Tag
-        }"""
-        )
+        lookup = defaultdict(set)
+        brick = rdflib.Namespace(self.g.store.namespace("brick") or BRICK)
+        # equivalent to
+        #   ?class rdfs:subClassOf+ brick:Class .
+        #   ?class brick:hasAssociatedTag ?tag .
+        #   ?tag rdf:type brick:Tag
+        # but walking the store's indexes directly
+        has_associated_tag = brick.hasAssociatedTag
+        tag_class = brick.Tag
         class2tag = defaultdict(set)
-        for (cname, tag) in res:
-            cname = cname.split("#")[1]
-            tag = tag.split("#")[1]
-            class2tag[cname].add(tag)
+        for klass in self.g._transitive_subjects(brick.Class, [RDFS.subClassOf]):
+            for tag in self.g.objects(klass, has_associated_tag):
+                if (tag, A, tag_class) in self.g:
+                    class2tag[_local(klass)].add(_local(tag))
         for cname, tagset in class2tag.items():
-            self.lookup[tuple(sorted(tagset))].add(cname)
-        pickle.dump(self.lookup, open("taglookup.pickle", "wb"))
+            lookup[tuple(sorted(tagset))].add(cname)
+        with open("taglookup.json", "w") as f:
+            f.write(_dump_tag_lookup(lookup))
+        self.lookup = lookup
 
     def _is_point(self, classname):
-        return (
-            len(
-                self.g.query(
-                    f"SELECT ?x WHERE {{ \
-            brick:{classname} rdfs:subClassOf* brick:Point . \
-            brick:{classname} a ?x }}"
-                )
-            )
-            > 0
-        )
+        return classname in self._class_names_under("Point")
 
     def _is_equip(self, classname):
-        return (
-            len(
-                self.g.query(
-                    f"SELECT ?x WHERE {{ \
-            brick:{classname} rdfs:subClassOf* brick:Equipment . \
-            brick:{classname} a ?x }}"
-                )
+        return classname in self._class_names_under("Equipment")
+
+    def _class_names_under(self, root):
+        """
+        Returns the names of the Brick classes that are (transitively) subclasses of
+        brick:<root>, including brick:<root> itself, and have an rdf:type. The
+        ontology does not change during a session, so this is computed once per root
+        """
+        names = self._subclass_names.get(root)
+        if names is None:
+            brick = self.g.store.namespace("brick") or BRICK
+            root_class = rdflib.URIRef(brick + root)
+            classes = self.g._transitive_subjects(root_class, [RDFS.subClassOf])
+            classes.add(root_class)
+            names = frozenset(
+                c[len(brick) :]
+                for c in classes
+                if c.startswith(brick) and (c, A, None) in self.g
             )
-            > 0
-        )
+            self._subclass_names[root] = names
+        return names
 
     def _translate_tags(self, tags):
         """"""
-        output_tags = []
+        output_tags = set()
         for tag in tags:
-            tag = tag.lower()
-            if tag not in tagmap:
-                output_tags.append(tag)
-                continue
-            output_tags.extend(tagmap[tag])
-        return set(output_tags)
+            output_tags.update(_translate_tag(tag))
+        return output_tags
 
     def lookup_tagset(self, tagset):
         """
@@ -475,34 +756,112 @@ class TagInferenceSession:
         Args:
             tagset (list of str): a list of tags
         """
+        self._check_tag_index()
         s = set(map(_to_tag_case, tagset))
+        return [
+            (set(self._tagset_classes[i]), set(self._tagsets[i]))
+            for i in self._match_indices(s)
+        ]
+
+    def _match_indices(self, s):
+        """
+        Returns the indices of the lookup table entries that match the given
+        (tag-cased) tags, in the order lookup_tagset returns them
+        """
         if self._approximate:
-            s.add("Point")
-            withpoint = [
-                (klass, set(tagset))
-                for tagset, klass in self.lookup.items()
-                if s.issuperset(set(tagset)) or s.issubset(set(tagset))
-            ]
-            s.remove("Point")
-            s.add("Equipment")
-            withequip = [
-                (klass, set(tagset))
-                for tagset, klass in self.lookup.items()
-                if s.issuperset(set(tagset)) or s.issubset(set(tagset))
-            ]
-            s.remove("Equipment")
-            s.add("Location")
-            withlocation = [
-                (klass, set(tagset))
-                for tagset, klass in self.lookup.items()
-                if s.issuperset(set(tagset)) or s.issubset(set(tagset))
-            ]
-            return withpoint + withequip + withlocation
+            # try the tags as a Point, then as Equipment, then as a Location
+            withpoint = s | {"Point"}
+            withequip = (s - {"Point"}) | {"Equipment"}
+            withlocation = (s - {"Point", "Equipment"}) | {"Location"}
+            return (
+                self._approximate_matches(withpoint)
+                + self._approximate_matches(withequip)
+                + self._approximate_matches(withlocation)
+            )
+
+        return self._exact_match(s)
+
+    def _build_tag_index(self):
+        """
+        Encodes each tagset in the lookup table as an integer bitmask over the
+        vocabulary of tags, so subset/superset tests are a couple of integer operations
+        """
+        self._tag_bits = {}
+        # the lookup table as parallel lists: entry i has the mask _tagset_masks[i],
+        # the tags _tagsets[i] and the classes _tagset_classes[i]
+        self._tagset_masks = []
+        self._tagsets = []
+        self._tagset_classes = []
+        # mask -> entry index, for exact matches
+        self._mask_index = {}
+        # tag -> indices of the entries whose tagsets contain it
+        self._tag_postings = defaultdict(list)
+        # indices of entries with no tags (these match any query)
+        self._empty_tagsets = []
+        # results of most_likely_tagsets depend on the lookup table
+        self._most_likely_cache = {}
+        # frozenset of tags -> class chosen by expand (None if there is no match)
+        self._expand_cache = {}
+        for tagset, klass in self.lookup.items():
+            mask = 0
+            for tag in tagset:
+                bit = self._tag_bits.setdefault(tag, 1 << len(self._tag_bits))
+                mask |= bit
+            index = len(self._tagset_masks)
+            self._mask_index[mask] = index
+            for tag in tagset:
+                self._tag_postings[tag].append(index)
+            if not tagset:
+                self._empty_tagsets.append(index)
+            self._tagset_masks.append(mask)
+            self._tagsets.append(frozenset(tagset))
+            self._tagset_classes.append(klass)
+
+    def _tags_mask(self, tags):
+        """
+        Returns the bitmask of the given tags, and whether any of them
+        are outside the vocabulary of the lookup table
+        """
+        mask = 0
+        unknown = False
+        for tag in tags:
+            bit = self._tag_bits.get(tag)
+            if bit is None:
+                unknown = True
+            else:
+                mask |= bit
+        return mask, unknown
+
+    def _exact_match(self, tags):
+        """
+        Returns the index of the lookup table entry whose tagset is exactly
+        the given tags, if there is one
+        """
+        mask, unknown = self._tags_mask(tags)
+        index = None if unknown else self._mask_index.get(mask)
+        if index is None:
+            return []
+        return [index]
 
+    def _approximate_matches(self, tags):
+        """
+        Returns the indices of the lookup table entries whose tagsets are
+        subsets or supersets of the given tags
+        """
+        mask, unknown = self._tags_mask(tags)
+        # any (non-empty) subset or superset of the tags shares at least one tag
+        # with them, so only entries in the postings of those tags can match
+        candidates = set(self._empty_tagsets)
+        for tag in tags:
+            candidates.update(self._tag_postings.get(tag, ()))
+        masks = self._tagset_masks
+        # a tag outside the vocabulary cannot be in any tagset
         return [
-            (klass, set(tagset))
-            for tagset, klass in self.lookup.items()
-            if s == set(tagset)
+            i
+            # keep the order of the lookup table
+            for i in sorted(candidates)
+            # tags is a superset of tagset, or tags is a subset of tagset
+            if not (masks[i] & ~mask) or (not unknown and not (mask & ~masks[i]))
         ]
 
     def most_likely_tagsets(self, orig_s, num=-1):
@@ -521,36 +880,61 @@ class TagInferenceSession:
             and (2) leftover (set of str): list of tags not used
 
         """
-        s = set(map(_to_tag_case, orig_s))
-        tagsets = self.lookup_tagset(s)
-        if len(tagsets) == 0:
+        self._check_tag_index()
+        s = frozenset(map(_to_tag_case, orig_s))
+        # many entities share the same tags, so results are memoized per tagset
+        cached = self._most_likely_cache.get(s)
+        if cached is None:
+            cached = self._most_likely_tagsets(s)
+            self._most_likely_cache[s] = cached
+        most_likely_classes, leftover = cached
+        if most_likely_classes is None:
             # no tags
             return [], orig_s
-        # find the highest number of tags that overlap
-        most_overlap = max(map(lambda x: len(s.intersection(x[1])), tagsets))
+        # return most likely classes (list) and leftover tags
+        # (what of 'orig_s' wasn't used)
+        if num < 0:
+            return list(most_likely_classes), set(leftover)
+        else:
+            return list(most_likely_classes[:num]), set(leftover)
 
-        # return the class with the fewest tags >= the overlap size
-        candidates = list(
-            filter(lambda x: len(s.intersection(x[1])) == most_overlap, tagsets)
-        )
+    def _most_likely_tagsets(self, s):
+        """
+        Computes the result of most_likely_tagsets for a frozenset of (tag-cased) tags.
+        Returns (None, None) if no tagsets match
+        """
+        indices = self._match_indices(s)
+        if len(indices) == 0:
+            return None, None
+        # score every candidate once on the bitmasks: (number of tags in common
+        # with s, number of tags the candidate has beyond s, entry index).
+        # Tags outside the vocabulary are in no tagset, so leaving them out of
+        # the mask does not change either count
+        mask, _ = self._tags_mask(s)
+        masks = self._tagset_masks
+        scored = [
+            (_popcount(masks[i] & mask), _popcount(masks[i] & ~mask), i)
+            for i in indices
+        ]
 
+        # find the highest number of tags that overlap
+        most_overlap = max(x[0] for x in scored)
+
+        # return the class with the fewest tags >= the overlap size.
         # When calculating the minimum difference, we calculate it form the
         # perspective of the candidate tagsets because they will have more tags
         # We want to find the tag set(s) who has the fewest tags over what was
         # provided
-        min_difference = min(map(lambda x: len(x[1].difference(s)), candidates))
-        most_likely = list(
-            filter(lambda x: len(x[1].difference(s)) == min_difference, candidates)
-        )
+        min_difference = min(x[1] for x in scored if x[0] == most_overlap)
+        most_likely = [
+            x for x in scored if x[0] == most_overlap and x[1] == min_difference
+        ]
 
-        leftover = s.difference(most_likely[0][1])
-        most_likely_classes = list(set([list(x[0])[0] for x in most_likely]))
-        # return most likely classes (list) and leftover tags
-        # (what of 'orig_s' wasn't used)
-        if num < 0:
-            return most_likely_classes, leftover
-        else:
-            return most_likely_classes[:num], leftover
+        leftover = s.difference(self._tagsets[most_likely[0][2]])
+        most_likely_classes = tuple(
+            {next(iter(self._tagset_classes[x[2]])) for x in most_likely}
+        )
+        return most_likely_classes, leftover
 
     def expand(self, graph):
         """
@@ -559,23 +943,38 @@ class TagInferenceSession:
         Args:
             graph (brickschema.graph.Graph): a Graph object containing triples
         """
-        for triple in self.g:
-            graph.add(triple)
-        entity_tags = defaultdict(set)
-        res = graph.query(
-            """SELECT ?ent ?tag WHERE {
-            ?ent brick:hasTag ?tag
-        }"""
+        from .graph import Graph
+
+        # a graph that loaded the same packaged Brick already has all of self.g
+        already_loaded = (
+            isinstance(graph, Graph)
+            and graph._load_brick
+            and not graph._load_brick_nightly
+            and graph._brick_version == self._packaged_brick
         )
-        for ent, tag in res:
-            entity_tags[ent].add(tag)
+        if not already_loaded:
+            graph.addN((s, p, o, graph) for (s, p, o) in self.g)
+        # use the same brick:hasTag the graph's prefix refers to
+        brick = rdflib.Namespace(graph.store.namespace("brick") or BRICK)
+        self._check_tag_index()
+        entity_tags = defaultdict(set)
+        for ent, _, tag in graph.triples((None, brick.hasTag, None)):
+            # keep just the tag names; lookup_tagset only needs those
+            entity_tags[ent].add(_local(tag))
+        inferred = []
         for entity, tagset in entity_tags.items():
-            tagset = list(map(lambda x: x.split("#")[-1], tagset))
-            lookup = self.lookup_tagset(tagset)
-            if len(lookup) == 0:
+            # entities often share tagsets, within a graph and across calls
+            key = frozenset(tagset)
+            if key in self._expand_cache:
+                klass = self._expand_cache[key]
+            else:
+                lookup = self.lookup_tagset(tagset)
+                klass = next(iter(lookup[0][0])) if len(lookup) > 0 else None
+                self._expand_cache[key] = klass
+            if klass is None:
                 continue
-            klasses = list(lookup[0][0])
-            graph.add((entity, A, BRICK[klasses[0]]))
+            inferred.append((entity, A, BRICK[klass]))
+        graph.addN((s, p, o, graph) for (s, p, o) in inferred)
 
 
 class HaystackInferenceSession(TagInferenceSession):
@@ -586,29 +985,27 @@ class HaystackInferenceSession(TagInferenceSession):
     a standard Haystack JSON export.
     """
 
-    def __init__(self, namespace):
+    def __init__(self, namespace, store="default"):
         """
         Creates a new HaystackInferenceSession that infers entities into
         the given namespace
         Args:
             namespace (str): namespace into which the inferred Brick entities
                              are deposited. Should be a valid URI
+            store (str or rdflib.store.Store): the rdflib store backing the session's
+                Brick graph, e.g. "Oxigraph" (requires the oxrdflib package)
         """
         super(HaystackInferenceSession, self).__init__(
-            approximate=True, load_brick=True
+            approximate=True, load_brick=True, store=store
         )
         self._generated_triples = []
         self._BLDG = rdflib.Namespace(namespace)
-        self._filters = [
-            lambda x: not x.startswith("his"),
-            lambda x: not x.endswith("Ref"),
-            lambda x: not x.startswith("cur"),
-            lambda x: x != ("disMacro"),
-            lambda x: x != "navName",
-            lambda x: x != "tz",
-            lambda x: x != "mod",
-            lambda x: x != "id",
-        ]
+        # a marker tag is only used for inference if it passes all of these
+        self._filters = list(_HAYSTACK_FILTERS)
+        # the default filters above as a single predicate; see _accept_tag
+        self._ignored_prefixes = ("his", "cur")
+        self._ignored_suffixes = ("Ref",)
+        self._ignored_tags = frozenset(["disMacro", "navName", "tz", "mod", "id"])
         self._point_tags = [
             "point",
             "sensor",
@@ -636,18 +1033,20 @@ class HaystackInferenceSession(TagInferenceSession):
         infer_results = []
         if identifier is None:
             raise Exception("PROVIDE IDENTIFIER")
+        tags = set(tagset)
+        safe_id = identifier.replace(" ", "_")
 
         # handle Site
-        if "site" in tagset and "equip" not in tagset and "point" not in tagset:
-            triples.append((self._BLDG[identifier.replace(" ", "_")], A, BRICK.Site))
-            return triples, [(identifier, list(tagset), [BRICK.Site])]
+        if "site" in tags and "equip" not in tags and "point" not in tags:
+            triples.append((self._BLDG[safe_id], A, _BRICK_SITE))
+            return triples, [(identifier, list(tagset), [_BRICK_SITE])]
 
         # take into account 'equipref' to avoid unnecessarily inventing equips
         if equip_ref is not None:
             equip_entity_id = equip_ref
             inferred_equip_classes = []
         else:
-            non_point_tags = set(tagset).difference(self._point_tags)
+            non_point_tags = tags.difference(self._point_tags)
             non_point_tags.add("equip")
             inferred_equip_classes, leftover_equip = self.most_likely_tagsets(
                 non_point_tags
@@ -655,69 +1054,46 @@ class HaystackInferenceSession(TagInferenceSession):
             inferred_equip_classes = [
                 c for c in inferred_equip_classes if self._is_equip(c)
             ]
-            equip_entity_id = identifier.replace(" ", "_") + "_equip"
+            equip_entity_id = safe_id + "_equip"
 
         # choose first class for now
-        point_entity_id = identifier.replace(" ", "_") + "_point"
+        point = self._BLDG[safe_id + "_point"]
 
         # check if this is a point; if so, infer what it is
-        if set(tagset).intersection(self._point_tags):
-            tagset = set(tagset).difference(set(["equip"]))
+        if not tags.isdisjoint(self._point_tags):
+            tagset = tags.difference(["equip"])
             inferred_point_classes, leftover_points = self.most_likely_tagsets(tagset)
             inferred_point_classes = [
                 c for c in inferred_point_classes if self._is_point(c)
             ]
             if len(inferred_point_classes) > 0:
-                triples.append(
-                    (self._BLDG[point_entity_id], A, BRICK[inferred_point_classes[0]])
-                )
-                triples.append(
-                    (
-                        self._BLDG[point_entity_id],
-                        RDFS.label,
-                        rdflib.Literal(identifier),
-                    )
-                )
+                triples.append((point, A, BRICK[inferred_point_classes[0]]))
+                triples.append((point, _RDFS_LABEL, rdflib.Literal(identifier)))
                 infer_results.append((identifier, list(tagset), inferred_point_classes))
 
         if len(inferred_equip_classes) > 0:
-            triples.append(
-                (self._BLDG[equip_entity_id], A, BRICK[inferred_equip_classes[0]])
-            )
-            triples.append(
-                (
-                    self._BLDG[equip_entity_id],
-                    BRICK.hasPoint,
-                    self._BLDG[point_entity_id],
-                )
-            )
-            triples.append(
-                (
-                    self._BLDG[equip_entity_id],
-                    RDFS.label,
-                    rdflib.Literal(identifier + " equip"),
-                )
-            )
-            triples.append(
-                (
-                    self._BLDG[point_entity_id],
-                    RDFS.label,
-                    rdflib.Literal(identifier + " point"),
-                )
-            )
+            equip = self._BLDG[equip_entity_id]
+            triples.append((equip, A, BRICK[inferred_equip_classes[0]]))
+            triples.append((equip, _BRICK_HAS_POINT, point))
+            triples.append((equip, _RDFS_LABEL, rdflib.Literal(identifier + " equip")))
+            triples.append((point, _RDFS_LABEL, rdflib.Literal(identifier + " point")))
             infer_results.append((identifier, list(tagset), inferred_equip_classes))
         return triples, infer_results
 
-    def _translate_tags(self, haystack_tags):
-        """"""
-        output_tags = []
-        for tag in haystack_tags:
-            tag = tag.lower()
-            if tag not in tagmap:
-                output_tags.append(tag)
-                continue
-            output_tags.extend(tagmap[tag])
-        return set(output_tags)
+    def _accept_tag(self, tag):
+        """
+        Returns True if the given Haystack marker tag should be used for inference,
+        i.e. it passes all of the filters in self._filters. While those are the
+        default filters, this is a single check against the ignored prefixes,
+        suffixes and tags instead of a call to each filter
+        """
+        if self._filters == _HAYSTACK_FILTERS:
+            return (
+                not tag.startswith(self._ignored_prefixes)
+                and not tag.endswith(self._ignored_suffixes)
+                and tag not in self._ignored_tags
+            )
+        return all(f(tag) for f in self._filters)
 
     def infer_model(self, model):
         """
@@ -736,14 +1112,15 @@ class HaystackInferenceSession(TagInferenceSession):
         entities = {e["id"].replace('"', ""): {"tags": e} for e in entities}
         # TODO: add e['dis'] for a descriptive label?
         brickgraph = Graph(load_brick=False)
+        # all inferred triples; added to brickgraph in one batch at the end
+        inferred = []
 
         # marker tag pass
         for entity_id, entity in entities.items():
             marker_tags = {
                 k for k, v in entity["tags"].items() if v == "m:" or v == "M"
             }
-            for f in self._filters:
-                marker_tags = list(filter(f, marker_tags))
+            marker_tags = [t for t in marker_tags if self._accept_tag(t)]
             # translate tags
             entity_tagset = list(self._translate_tags(marker_tags))
 
@@ -752,30 +1129,51 @@ class HaystackInferenceSession(TagInferenceSession):
             triples, _ = self.infer_entity(
                 entity_tagset, identifier=entity_id, equip_ref=equip_ref
             )
-            brickgraph.add(*triples)
-            self._generated_triples.extend(triples)
+            inferred.extend(triples)
+        # subjects and objects of the entities inferred so far
+        nodes = {s for (s, _, _) in inferred} | {o for (_, _, o) in inferred}
 
         # take a pass through for relationships
         for entity_id, entity in entities.items():
-            relships = {k: v for k, v in entity["tags"].items() if k.endswith("Ref")}
-            # equip_entity_id = entity_id.replace(' ', '_') + '_equip'
-            point_entity_id = entity_id.replace(" ", "_") + "_point"
-            if "equipRef" not in relships:
+            equip_ref = entity["tags"].get("equipRef")
+            if equip_ref is None:
                 continue
-            reffed_equip = (
-                relships["equipRef"].replace(" ", "_").replace('"', "") + "_equip"
-            )
-            if self._BLDG[point_entity_id] in brickgraph.nodes:
-                triple = (
-                    self._BLDG[reffed_equip],
-                    BRICK.hasPoint,
-                    self._BLDG[point_entity_id],
-                )
-                brickgraph.add(triple)
-                self._generated_triples.append(triple)
+            # equip_entity_id = entity_id.replace(' ', '_') + '_equip'
+            point = self._BLDG[entity_id.replace(" ", "_") + "_point"]
+            reffed_equip = equip_ref.replace(" ", "_").replace('"', "") + "_equip"
+            if point in nodes:
+                inferred.append((self._BLDG[reffed_equip], _BRICK_HAS_POINT, point))
+
+        brickgraph.addN((s, p, o, brickgraph) for (s, p, o) in inferred)
+        self._generated_triples.extend(inferred)
         return brickgraph
 
 
+def _ordered_subclasses(graph, klass):
+    """
+    Returns the given class and its (transitive) subclasses, in the order a
+    breadth-first walk of rdfs:subClassOf reaches them; the equivalent of
+    ?subclass rdfs:subClassOf* klass
+
+    Args:
+        graph (rdflib.Graph): graph containing the class hierarchy
+        klass (rdflib.URIRef): the class to start from
+    Returns:
+        classes (list of rdflib.URIRef): the class followed by its subclasses
+    """
+    seen = {klass: None}
+    frontier = [klass]
+    while frontier:
+        next_frontier = []
+        for current in frontier:
+            for subclass in graph.subjects(RDFS.subClassOf, current):
+                if subclass not in seen:
+                    seen[subclass] = None
+                    next_frontier.append(subclass)
+        frontier = next_frontier
+    return list(seen)
+
+
 def _get_common_prefix(list_of_strings):
     """
     Returns the longest common prefix among the set of strings.
@@ -786,23 +1184,309 @@ def _get_common_prefix(list_of_strings):
     Returns:
         pfx (str): longest common prefix
     """
-    # https://stackoverflow.com/questions/6718196/determine-prefix-from-a-set-of-similar-strings
-    def all_same(x):
-        return all(x[0] == y for y in x)
+    if not list_of_strings:
+        return ""
+    # the common prefix of all the strings is that of the smallest and largest
+    first, last = min(list_of_strings), max(list_of_strings)
+    if first == last:
+        # a single string, or all the same
+        return first.strip("-")
+    # character-wise, despite the name
+    return os.path.commonprefix([first, last]).strip("-")
+
+
+@functools.lru_cache(maxsize=4096)
+def _translate_tag(tag):
+    """
+    Returns the Brick tags for a single Haystack tag. Haystack models repeat a
+    small vocabulary of tags, so translations are cached
 
-    char_tuples = zip(*list_of_strings)
-    prefix_tuples = itertools.takewhile(all_same, char_tuples)
-    return "".join(x[0] for x in prefix_tuples).strip("-")
+    Args:
+        tag (str): a Haystack tag
+    Returns:
+        tags (tuple of str): the equivalent Brick tags
+    """
+    tag = tag.lower()
+    return tuple(tagmap.get(tag, (tag,)))
 
 
+@functools.lru_cache(maxsize=4096)
 def _to_tag_case(x):
     """
     Returns the string in "tag case" where the first letter
-    is capitalized
+    is capitalized. Tags repeat across entities, so results are cached
 
     Args:
         x (str): input string
     Returns:
         x (str): transformed string
     """
-    return x[0].upper() + x[1:]
+    return x[:1].upper() + x[1:]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_tag_lookup(brick_version):
+    """
+    Loads the packaged tag lookup table (sorted tag tuple -> frozenset of Brick
+    class names) for the given Brick version. Parsed once per process; the returned
+    dictionary is shared and must not be modified
+
+    Args:
+        brick_version (str): the MAJOR.MINOR version of the packaged Brick ontology
+
+    Returns:
+        lookup (dict): the tag lookup table
+    """
+    data = pkgutil.get_data(__name__, f"ontologies/{brick_version}/taglookup.json")
+    return {tuple(tags): frozenset(classes) for tags, classes in json.loads(data)}
+
+
+def _dump_tag_lookup(lookup):
+    """
+    Serializes a tag lookup table to the JSON format read by _load_tag_lookup:
+    a list of [tags, classes] pairs, one per line. The order of the entries
+    is kept because inference results depend on it
+
+    Args:
+        lookup (dict): the tag lookup table
+
+    Returns:
+        data (str): the JSON document
+    """
+    rows = [
+        json.dumps([list(tags), sorted(classes)]) for tags, classes in lookup.items()
+    ]
+    return "[\n" + ",\n".join(rows) + "\n]\n"
+
+
+@functools.lru_cache(maxsize=4096)
+def _local(uri):
+    """
+    Returns the part of a URI after its last '#' (e.g. the Brick class or tag name).
+    The same class and tag URIs come up again and again, so results are cached
+
+    Args:
+        uri (str): input URI
+    Returns:
+        name (str): the fragment of the URI
+    """
+    return uri.rpartition("#")[2]
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_alignment_file(path, mtime):
+    """
+    Parses a (non-packaged) alignment file. Results are cached per path and
+    modification time, so sessions using the same file only parse it once
+
+    Args:
+        path (str): absolute path to the file
+        mtime (float): modification time of the file; part of the cache key
+    Returns:
+        graph (rdflib.Graph): the parsed file
+    """
+    graph = rdflib.Graph(bind_namespaces="core")
+    graph.parse(path, format=rdflib.util.guess_format(path))
+    return graph
+
+
+def _combine_patterns(patterns):
+    """
+    Returns a single regex that matches whatever any of the given patterns match,
+    or None if they cannot be combined: patterns with inline global flags (e.g.
+    '(?i)') or group references change meaning inside a larger alternation
+
+    Args:
+        patterns (iterable of str): regular expressions
+    Returns:
+        any_pattern (re.Pattern): the combined regex, or None
+    """
+    patterns = [str(pattern) for pattern in patterns]
+    for pattern in patterns:
+        try:
+            compiled = re.compile(pattern)
+        except re.error:
+            return None
+        if compiled.groups or compiled.flags & ~re.UNICODE:
+            # numbered groups (and so backreferences) would be renumbered
+            # in the combination, and global flags must come first
+            return None
+    try:
+        return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+    except re.error:
+        return None
+
+
+def _match_vbis_tags(compiled_patterns, any_pattern, master_list, encoding):
+    """
+    Returns the VBIS tags in a master list that match each of the given patterns.
+    The result only depends on the patterns and the master list, so it is stored
+    as JSON in the cache directory, keyed by a hash of both
+
+    Args:
+        compiled_patterns (list): (compiled regex, pattern) pairs
+        any_pattern (re.Pattern): regex matching whatever any of the patterns
+            match, or None to try every pattern on every tag
+        master_list (bytes): contents of a VBIS tag master list (CSV)
+        encoding (str): encoding of the master list
+    Returns:
+        matches (dict): pattern (str) -> the VBIS tags it matches, in master list order
+    """
+    from .graph import _cache_path, _write_cache_file
+
+    digest = hashlib.blake2b(digest_size=16)
+    patterns = sorted({str(pattern) for _, pattern in compiled_patterns})
+    digest.update(json.dumps([patterns, encoding]).encode("utf-8"))
+    digest.update(master_list)
+    cache_file = _cache_path(f"vbis-tags-{digest.hexdigest()}.json")
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read cached VBIS tags {cache_file}: {e}")
+
+    matches = defaultdict(list)
+    # decode lines as the CSV reader asks for them
+    rdr = csv.DictReader(
+        io.TextIOWrapper(io.BytesIO(master_list), encoding=encoding, newline="")
+    )
+    for row in rdr:
+        vbistag = row["VBIS Tag"]
+        if any_pattern is not None and not any_pattern.match(vbistag):
+            continue
+        for regex, pattern in compiled_patterns:
+            if regex.match(vbistag):
+                matches[str(pattern)].append(vbistag)
+    _write_cache_file(cache_file, json.dumps(matches).encode("utf-8"))
+    return matches
+
+
+def _graph_fingerprint(graph):
+    """
+    Returns a fingerprint of the triples in the graph that does not depend on
+    the order they are stored in: the number of triples and the sum of the
+    blake2b digests of each triple in N-Triples form
+
+    Args:
+        graph (rdflib.Graph): the graph to fingerprint
+    Returns:
+        fingerprint (tuple): (number of triples, digest sum)
+    """
+    total = 0
+    for s, p, o in graph:
+        digest = hashlib.blake2b(
+            f"{s.n3()} {p.n3()} {o.n3()}".encode("utf-8"), digest_size=16
+        ).digest()
+        total += int.from_bytes(digest, "big")
+    return len(graph), total
+
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+else:  # Python < 3.10
+
+    def _popcount(x):
+        """
+        Returns the number of set bits in a non-negative integer
+        """
+        return bin(x).count("1")
+
+
+def cache_brick_closure(brick_version="1.3", semantics="owlrl"):
+    """
+    Computes the triples that OWL-RL (or RDFS) reasoning adds to the packaged Brick
+    ontology and keeps them for this process and, if BRICKSCHEMA_CACHE_DIR is set,
+    in the cache directory. Later expansions of graphs
+    created with load_brick=True start from these triples, so the reasoner converges
+    in fewer passes. Without this cache, expansion reasons over Brick as usual
+
+    Triples mentioning blank nodes are left out because blank node identity does
+    not survive a round trip through a file, as are the generalized triples (e.g.
+    with a literal subject) that N-Triples cannot express; the reasoner re-derives
+    those
+
+    Args:
+        brick_version (str): the MAJOR.MINOR version of the packaged Brick ontology
+        semantics (str): "owlrl" or "rdfs"
+
+    Returns:
+        closure (rdflib.Graph): the inferred triples
+    """
+    import owlrl
+    from .graph import Graph, _write_cache_file
+
+    brick = Graph(load_brick=True, brick_version=brick_version)
+    asserted = set(brick)
+    rules = owlrl.RDFS_Semantics if semantics == "rdfs" else owlrl.OWLRL_Semantics
+    owlrl.DeductiveClosure(rules).expand(brick)
+    closure = rdflib.Graph(bind_namespaces="none")
+    closure.addN(
+        (s, p, o, closure)
+        for (s, p, o) in brick
+        if (s, p, o) not in asserted
+        and isinstance(s, rdflib.URIRef)
+        and isinstance(p, rdflib.URIRef)
+        and not isinstance(o, rdflib.BNode)
+    )
+    _write_cache_file(
+        _brick_closure_file(brick_version, semantics),
+        closure.serialize(format="nt", encoding="utf-8"),
+    )
+    _brick_closures[(brick_version, semantics)] = closure
+    return closure
+
+
+def _cached_brick_closure(brick_version, semantics="owlrl"):
+    """
+    Returns the triples that reasoning adds to the packaged Brick ontology if they
+    were stored by cache_brick_closure, otherwise None. The file is read once per
+    process
+
+    Args:
+        brick_version (str): the MAJOR.MINOR version of the packaged Brick ontology
+        semantics (str): "owlrl" or "rdfs"
+
+    Returns:
+        closure (rdflib.Graph): the inferred triples, or None
+    """
+    closure = _brick_closures.get((brick_version, semantics))
+    if closure is not None:
+        return closure
+    cache_file = _brick_closure_file(brick_version, semantics)
+    if cache_file is None or not os.path.exists(cache_file):
+        return None
+    closure = rdflib.Graph(bind_namespaces="none")
+    try:
+        closure.parse(cache_file, format="nt")
+    except Exception as e:
+        logger.warning(f"Could not read cached Brick closure {cache_file}: {e}")
+        return None
+    _brick_closures[(brick_version, semantics)] = closure
+    return closure
+
+
+def _brick_closure_file(brick_version, semantics):
+    """
+    Returns the path of the cached Brick closure, or None if the on-disk cache is
+    turned off. The name includes a hash of the packaged ontology and the owlrl
+    version, because the reasoner's rules can change between releases
+    """
+    from .graph import _cache_path
+
+    return _cache_path(
+        f"Brick-{brick_version}-{semantics}-{_brick_closure_key(brick_version)}.nt"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _brick_closure_key(brick_version):
+    """
+    Returns the hash identifying the closure of the packaged Brick ontology
+    """
+    import owlrl
+
+    data = pkgutil.get_data(__name__, f"ontologies/{brick_version}/Brick.ttl")
+    digest = hashlib.blake2b(data, digest_size=16)
+    digest.update(owlrl.__version__.encode("utf-8"))
+    return digest.hexdigest()
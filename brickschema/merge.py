@@ -37,15 +37,14 @@ def unify_entities(G, e1, e2):
     print(Style.BRIGHT + Fore.CYAN + f"Unifying {e1} and {e2}" + Style.RESET_ALL)
     e1 = URIRef(e1)
     e2 = URIRef(e2)
-    pos = G.predicate_objects(subject=e2)
-    for (p, o) in pos:
-        G.remove((e2, p, o))
-        G.add((e1, p, o))
-
-    sps = G.subject_predicates(object=e2)
-    for (s, p) in sps:
-        G.remove((s, p, e2))
-        G.add((s, p, e1))
+    # materialize the matches before modifying the graph
+    pos = list(G.predicate_objects(subject=e2))
+    G.remove((e2, None, None))
+    G.addN((e1, p, o, G) for (p, o) in pos)
+
+    sps = list(G.subject_predicates(object=e2))
+    G.remove((None, None, e2))
+    G.addN((s, p, e1, G) for (s, p) in sps)
 
 
 def get_entity_feature_vectors(g, namespace):
@@ -299,12 +299,10 @@ class VersionedGraphCollection(ConjunctiveGraph, BrickBase):
         # if graph is specified, only copy triples from that graph.
         # otherwise, copy triples from all graphs.
         if graph is not None:
-            for t in self.get_context(graph).triples((None, None, None)):
-                g.add(t)
+            g.addN((s, p, o, g) for (s, p, o) in self.get_context(graph))
         else:
             # TODO: this doesn't work for some reason
-            for t in self.triples((None, None, None)):
-                g.add(t)
+            g.addN((s, p, o, g) for (s, p, o) in self.triples((None, None, None)))
         with self.conn() as conn:
             return self._graph_at(g, conn, timestamp, graph)
 
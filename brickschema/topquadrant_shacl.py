@@ -100,10 +100,11 @@ def infer(
             inferred_triples = rdflib.Graph()
             inferred_triples.parse(inferred_file_path, format="turtle")
             print(f"Got {len(inferred_triples)} inferred triples")
-            for s, p, o in inferred_triples:
-                if isinstance(s, BNode) or isinstance(o, BNode):
-                    continue
-                data_graph_skolemized.add((s, p, o))
+            data_graph_skolemized.addN(
+                (s, p, o, data_graph_skolemized)
+                for s, p, o in inferred_triples
+                if not isinstance(s, BNode) and not isinstance(o, BNode)
+            )
 
             # Update the size of the graph
             previous_size = current_size
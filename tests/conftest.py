@@ -1,3 +1,4 @@
+import os
 import pytest
 
 # using code from https://docs.pytest.org/en/latest/example/simple.html
@@ -23,6 +24,20 @@ def pytest_collection_modifyitems(config, items):
             item.add_marker(skip_slow)
 
 
+@pytest.fixture(autouse=True, scope="session")
+def brickschema_cache_dir(tmp_path_factory):
+    """
+    Turns on brickschema's on-disk cache, in a temporary directory
+    """
+    old = os.environ.get("BRICKSCHEMA_CACHE_DIR")
+    os.environ["BRICKSCHEMA_CACHE_DIR"] = str(tmp_path_factory.mktemp("cache"))
+    yield
+    if old is None:
+        del os.environ["BRICKSCHEMA_CACHE_DIR"]
+    else:
+        os.environ["BRICKSCHEMA_CACHE_DIR"] = old
+
+
 def pytest_generate_tests(metafunc):
     """
     Generates Brick tests for a variety of contexts
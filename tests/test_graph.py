@@ -1,3 +1,5 @@
+import os
+import pytest
 from brickschema import Graph, GraphCollection
 from brickschema.namespaces import BRICK, UNIT, A
 from rdflib import Namespace, Literal, URIRef
@@ -119,3 +121,215 @@ def test_collection():
 
     # res = g.query("SELECT * WHERE { ?x a brick:Sensor }")
     # assert len(res) == 3, "Should now have 3 sensors from adding graph"
+
+
+def test_expand_after_modification():
+    EX = Namespace("urn:ex#")
+    g = Graph(load_brick=True)
+    g.add((EX["a"], A, BRICK.Temperature_Sensor))
+    g.expand("rdfs")
+    assert (EX["a"], A, BRICK.Point) in g
+
+    # expanding again after a change must not be skipped
+    g.add((EX["b"], A, BRICK.Temperature_Sensor))
+    g.expand("rdfs")
+    assert (EX["b"], A, BRICK.Point) in g
+
+
+def test_expand_shacl_repeats():
+    EX = Namespace("urn:ex#")
+    rules = Graph()
+    rules.parse(
+        data="""@prefix ex: <urn:ex#> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+ex:IsB a sh:NodeShape ;
+    sh:class ex:B .
+ex:AShape a sh:NodeShape ;
+    sh:targetClass ex:A ;
+    sh:rule [ a sh:TripleRule ; sh:order 0 ;
+        sh:condition ex:IsB ;
+        sh:subject sh:this ; sh:predicate rdf:type ; sh:object ex:C ] ;
+    sh:rule [ a sh:TripleRule ; sh:order 1 ;
+        sh:subject sh:this ; sh:predicate rdf:type ; sh:object ex:B ] .
+""",
+        format="turtle",
+    )
+    g = Graph()
+    g += rules
+    g.add((EX["x"], A, EX["A"]))
+    # the rule deriving ex:C (for an ex:B) runs before the one deriving ex:B,
+    # so a single pass does not reach the fixpoint
+    g.expand("shacl", iterative=False, simplify=False)
+    assert (EX["x"], A, EX["B"]) in g
+    assert (EX["x"], A, EX["C"]) not in g
+    # and a repeated expand is not skipped
+    g.expand("shacl", iterative=False, simplify=False)
+    assert (EX["x"], A, EX["C"]) in g
+
+
+def test_list_extensions_and_alignments():
+    g = Graph()
+    assert "shacl_tag_inference" in g.get_extensions()
+    assert set(g.get_alignments()) == {"BOT", "REC", "VBIS"}
+
+
+def test_nodes_tracks_changes():
+    EX = Namespace("urn:ex#")
+    g = Graph()
+    g.add((EX["a"], A, BRICK["Sensor"]))
+    assert g.nodes == {EX["a"], BRICK["Sensor"]}
+
+    g.add((EX["b"], A, BRICK["Sensor"]))
+    assert EX["b"] in g.nodes
+
+    g.remove((EX["a"], None, None))
+    assert g.nodes == {EX["b"], BRICK["Sensor"]}
+
+    # each call returns a new set; changing it does not change the graph's
+    nodes = g.nodes
+    nodes.add(EX["c"])
+    assert EX["c"] not in g.nodes
+
+    # triples added to the store directly are seen too
+    g.store.add((EX["d"], A, BRICK["Sensor"]), context=g)
+    assert EX["d"] in g.nodes
+
+
+def test_load_ntriples_style_turtle(tmp_path):
+    # absolute IRIs only: read with the N-Triples parser
+    absolute = tmp_path / "absolute.ttl"
+    absolute.write_text('<urn:ex#a> <urn:ex#b> "c" .\n')
+    g = Graph().load_file(str(absolute))
+    assert (URIRef("urn:ex#a"), URIRef("urn:ex#b"), Literal("c")) in g
+
+    # relative IRIs are valid Turtle but not N-Triples; they resolve against the file
+    relative = tmp_path / "relative.ttl"
+    relative.write_text("<a> <b> <c> .\n")
+    g = Graph().load_file(str(relative))
+    assert len(g) == 1
+    s, p, o = next(iter(g))
+    assert s.startswith("file://") and s.endswith("/a")
+
+    # Turtle allows terms without whitespace between them; N-Triples does not
+    compact = tmp_path / "compact.ttl"
+    compact.write_text("<urn:ex#a><urn:ex#b><urn:ex#c>.\n_:x<urn:ex#b>_:y.\n")
+    g = Graph().load_file(str(compact))
+    assert (URIRef("urn:ex#a"), URIRef("urn:ex#b"), URIRef("urn:ex#c")) in g
+    assert len(g) == 2
+
+    # an invalid escape is an error in Turtle, not read leniently as N-Triples
+    bad_escape = tmp_path / "bad_escape.ttl"
+    bad_escape.write_text('<urn:ex#a> <urn:ex#b> "x\\q" .\n')
+    with pytest.raises(Exception):
+        Graph().load_file(str(bad_escape))
+
+    # only the start of the file is checked; a later Turtle statement falls back
+    # to the Turtle parser without leaving partial results behind
+    mixed = tmp_path / "mixed.ttl"
+    lines = [f"<urn:ex#s{i}> <urn:ex#p> _:b{i} .\n" for i in range(200)]
+    mixed.write_text("".join(lines) + "@prefix ex: <urn:ex#> .\nex:a ex:b ex:c .\n")
+    g = Graph().load_file(str(mixed))
+    assert len(g) == 201
+
+
+def test_packaged_ontology_cache(tmp_path, monkeypatch):
+    from brickschema.graph import _parse_packaged_ontology
+
+    parse = _parse_packaged_ontology.__wrapped__  # bypass the in-process cache
+    path = "ontologies/1.3/alignments/Brick-BOT-alignment.ttl"
+    monkeypatch.setenv("BRICKSCHEMA_CACHE_DIR", str(tmp_path))
+
+    # the first parse writes an N-Triples copy; later parses read it back,
+    # prefixes included
+    parsed = parse(path)
+    cached = list(tmp_path.glob("Brick-BOT-alignment-*.nt"))
+    assert len(cached) == 1
+    from_cache = parse(path)
+    assert set(from_cache) == set(parsed)
+    assert dict(from_cache.namespaces()) == dict(parsed.namespaces())
+
+    # a broken cache file is ignored
+    cached[0].write_text("not n-triples")
+    assert set(parse(path)) == set(parsed)
+
+    # nothing is written unless a cache directory is set
+    monkeypatch.delenv("BRICKSCHEMA_CACHE_DIR")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    assert set(parse(path)) == set(parsed)
+    assert not (tmp_path / "home").exists()
+    assert not (tmp_path / "xdg").exists()
+
+
+def test_load_file_source_format():
+    import io
+    from brickschema.graph import _guess_source_format
+
+    EX = Namespace("urn:ex#")
+    turtle = """@prefix ex: <urn:ex#> .
+ex:a ex:b ex:c ."""
+    xml = """<?xml version="1.0"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:ex="urn:ex#">
+  <rdf:Description rdf:about="urn:ex#a"><ex:b rdf:resource="urn:ex#c"/></rdf:Description>
+</rdf:RDF>"""
+    # no prefix declarations: parsed as N3, a superset of Turtle
+    n3 = "<urn:ex#a> <urn:ex#b> <urn:ex#c> ."
+    for data, fmt in [(turtle, "turtle"), (xml, "xml"), (n3, "n3")]:
+        for source in [io.StringIO(data), io.BytesIO(data.encode())]:
+            # sniffing does not consume the source
+            assert _guess_source_format(source) == fmt
+            assert source.tell() == 0
+            g = Graph().load_file(source=source)
+            assert (EX["a"], EX["b"], EX["c"]) in g
+
+    # streams that cannot be rewound are not sniffed
+    class Stream:
+        def __init__(self, data):
+            self.read = io.BytesIO(data.encode()).read
+
+    assert _guess_source_format(Stream(turtle)) is None
+    g = Graph().load_file(source=Stream(turtle))
+    assert (EX["a"], EX["b"], EX["c"]) in g
+
+    # RDF/XML that does not look like it (a typed node as the root element) is
+    # still loaded, after the guessed format fails
+    typed_node = """<ex:Thing xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:ex="urn:ex#" rdf:about="urn:ex#a"><ex:b rdf:resource="urn:ex#c"/></ex:Thing>"""
+    with pytest.warns(UserWarning):
+        g = Graph().load_file(source=io.StringIO(typed_node))
+    assert (EX["a"], EX["b"], EX["c"]) in g
+
+
+def test_query_reuses_prepared_queries():
+    from brickschema.graph import _prepare_query
+
+    EX = Namespace("urn:ex#")
+    g = Graph()
+    g.bind("ex", EX)
+    g.add((EX["a"], A, BRICK.AHU))
+    q = "SELECT ?x WHERE { ?x a brick:AHU }"
+    assert len(g.query(q)) == 1
+
+    # the parsed query is reused, and still sees changes to the data
+    hits = _prepare_query.cache_info().hits
+    g.add((EX["b"], A, BRICK.AHU))
+    assert len(g.query(q)) == 2
+    assert _prepare_query.cache_info().hits == hits + 1
+
+    # prefixes are part of the cache key
+    g.bind("ex", Namespace("urn:other#"), override=True, replace=True)
+    assert len(g.query("SELECT ?x WHERE { ex:a a brick:AHU }")) == 0
+    g.bind("ex", EX, override=True, replace=True)
+    assert len(g.query("SELECT ?x WHERE { ex:a a brick:AHU }")) == 1
+
+
+def test_cache_dir(monkeypatch):
+    from brickschema.graph import _cache_dir
+
+    # the on-disk cache is opt-in
+    monkeypatch.delenv("BRICKSCHEMA_CACHE_DIR", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", "/xdg/cache")
+    assert _cache_dir() is None
+    monkeypatch.setenv("BRICKSCHEMA_CACHE_DIR", "/brick/cache")
+    assert _cache_dir() == "/brick/cache"
@@ -63,6 +63,34 @@ def test_lookup_tagset():
     assert tagsets[0][0] == set(["Max_Air_Flow_Setpoint_Limit"])
 
 
+def test_packaged_tag_lookup():
+    from brickschema.inference import _load_tag_lookup, _dump_tag_lookup
+
+    lookup = _load_tag_lookup("1.3")
+    assert lookup[("AHU", "Equipment")] == {"AHU"}
+    # the JSON format round-trips
+    assert (
+        _dump_tag_lookup(lookup)
+        == pkgutil.get_data("brickschema", "ontologies/1.3/taglookup.json").decode()
+    )
+
+    # the session's table can be changed in place; matching follows the changes
+    session = TagInferenceSession(approximate=False)
+    session.lookup[("AHU", "Equipment")].add("Not_A_Class")
+    assert session.lookup_tagset(["AHU", "Equipment"])[0][0] == {"AHU", "Not_A_Class"}
+    session.lookup[("AHU", "Equipment")] = {"Not_A_Class"}
+    assert session.lookup_tagset(["AHU", "Equipment"])[0][0] == {"Not_A_Class"}
+    session.lookup[("My", "Tag")].add("My_Class")
+    assert session.lookup_tagset(["My", "Tag"])[0][0] == {"My_Class"}
+    del session.lookup[("My", "Tag")]
+    assert session.lookup_tagset(["My", "Tag"]) == []
+    # ...or replaced
+    session.lookup = {("AHU", "Equipment"): {"AHU"}}
+    assert session.lookup_tagset(["AHU", "Equipment"])[0][0] == {"AHU"}
+    # the packaged table is not changed
+    assert lookup[("AHU", "Equipment")] == {"AHU"}
+
+
 def test_most_likely_tagsets():
     session = TagInferenceSession(approximate=True)
     assert session is not None
@@ -143,6 +171,20 @@ def test_haystack_inference():
     assert len(equips) == 4
 
 
+def test_haystack_tag_filters():
+    session = HaystackInferenceSession("http://example.org/carytown#")
+    assert session._accept_tag("temp")
+    assert not session._accept_tag("hisInterpolate")
+    assert not session._accept_tag("siteRef")
+    assert not session._accept_tag("navName")
+
+    # extra filters are honoured
+    session._filters.append(lambda x: x != "temp")
+    assert not session._accept_tag("temp")
+    assert not session._accept_tag("siteRef")
+    assert session._accept_tag("air")
+
+
 def test_rdfs_inference_subclass():
     EX = Namespace("http://example.com/building#")
     graph = Graph(load_brick=True).from_triples(
@@ -213,3 +255,61 @@ def test_inference_tags():
     res2 = filter_bnodes(res2)
 
     assert set(res2) == set(map(lambda x: (x,), expected))
+
+
+def test_reasonable_closure_cache():
+    pytest.importorskip("reasonable")
+    from brickschema import inference
+
+    def make_graph():
+        g = Graph(load_brick=False)
+        g.add((BRICK["ahu1"], RDF.type, BRICK.AHU))
+        g.add((BRICK.AHU, RDFS.subClassOf, BRICK.Equipment))
+        return g
+
+    try:
+        # off by default
+        make_graph().expand("owlrl", backend="reasonable")
+        assert len(inference._reasonable_closures) == 0
+
+        inference.set_closure_cache_size(100000)
+        g1 = make_graph().expand("owlrl", backend="reasonable")
+        assert len(inference._reasonable_closures) == 1
+        # the same triples reuse the cached closure
+        g2 = make_graph().expand("owlrl", backend="reasonable")
+        assert len(inference._reasonable_closures) == 1
+        assert set(g1) == set(g2)
+        assert (BRICK["ahu1"], RDF.type, BRICK.Equipment) in g2
+
+        # closures larger than the limit are dropped
+        inference.set_closure_cache_size(1)
+        assert len(inference._reasonable_closures) == 0
+        inference.set_closure_cache_size(100000)
+        make_graph().expand("owlrl", backend="reasonable")
+        inference.clear_closure_cache()
+        assert len(inference._reasonable_closures) == 0
+    finally:
+        inference.set_closure_cache_size(0)
+
+
+def test_brick_closure_cache(tmp_path, monkeypatch):
+    import owlrl
+    from brickschema import inference
+
+    monkeypatch.setenv("BRICKSCHEMA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(inference, "_brick_closures", {})
+    # nothing is computed until asked for
+    assert inference._cached_brick_closure("1.3", "rdfs") is None
+    assert not list(tmp_path.glob("Brick-1.3-rdfs-*.nt"))
+
+    inferred = inference.cache_brick_closure("1.3", "rdfs")
+    assert (BRICK.AHU, RDF.type, RDFS.Resource) in inferred
+    assert len(list(tmp_path.glob("Brick-1.3-rdfs-*.nt"))) == 1
+
+    # a new process reads the file instead of reasoning again
+    def fail(*args, **kwargs):
+        raise AssertionError("reasoner should not run")
+
+    monkeypatch.setattr(inference, "_brick_closures", {})
+    monkeypatch.setattr(owlrl, "DeductiveClosure", fail)
+    assert set(inference._cached_brick_closure("1.3", "rdfs")) == set(inferred)
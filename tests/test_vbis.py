@@ -50,3 +50,48 @@ def test_brick_to_vbis_inference_with_owlrl():
 
 
 # TODO: do without owlrl inference
+
+
+def test_vbis_tag_cache(tmp_path, monkeypatch):
+    from brickschema import inference
+
+    monkeypatch.setenv("BRICKSCHEMA_CACHE_DIR", str(tmp_path))
+    session = VBISTagInferenceSession()
+    assert len(list(tmp_path.glob("vbis-tags-*.json"))) == 1
+
+    # a second session reads the matches instead of scanning the master list
+    def fail(*args, **kwargs):
+        raise AssertionError("master list should not be read")
+
+    monkeypatch.setattr(inference.csv, "DictReader", fail)
+    cached = VBISTagInferenceSession()
+    assert cached._pattern2vbistag == session._pattern2vbistag
+    assert BRICK.AHU in cached.lookup_brick_class("ME-AHU-Su")
+
+
+def test_filter_to_most_specific_keeps_order():
+    session = VBISTagInferenceSession()
+    g = Graph(load_brick=True)
+    # unrelated classes: the first one given wins
+    assert session._filter_to_most_specific(g, [BRICK.AHU, BRICK.Chiller]) == BRICK.AHU
+    assert (
+        session._filter_to_most_specific(g, [BRICK.Chiller, BRICK.AHU]) == BRICK.Chiller
+    )
+    # otherwise the most specific class does, wherever it is
+    assert (
+        session._filter_to_most_specific(
+            g, [BRICK.HVAC_Equipment, BRICK.Air_Handling_Unit]
+        )
+        == BRICK.Air_Handling_Unit
+    )
+
+
+def test_combine_patterns():
+    from brickschema.inference import _combine_patterns
+
+    combined = _combine_patterns(["^ME-AHU.*$", "^ME-Fa.*$"])
+    assert combined.match("ME-Fa-EF")
+    assert not combined.match("EL-LV")
+    # patterns that would change meaning (or fail) in one alternation
+    assert _combine_patterns(["(?i)^me-ahu.*$", "^ME-Fa.*$"]) is None
+    assert _combine_patterns(["^(ME)-\\1$", "^ME-Fa.*$"]) is None